@@ -0,0 +1,128 @@
+# Cooling schedules for the simulated-annealing mode of CipherBreaker.break_cipher_counts.
+# A swap changing the log-likelihood by delta is accepted with probability min(1, exp(delta / T)),
+# where T is the temperature of the schedule: T = 1 is the plain Metropolis chain, a high T wanders,
+# a low T only climbs. Every schedule exposes the same two methods:
+#   - start(): resets the schedule at the beginning of a run
+#   - update(iteration, accepted, improved): called after every iteration, returns the new temperature
+
+
+class ConstantSchedule:
+    def __init__(self, temperature=1.0):
+        """
+        Initializes the ConstantSchedule object: the temperature never changes (T = 1 is plain Metropolis).
+
+        Args:
+            temperature (float, optional): The temperature. Defaults to 1.
+        """
+        self.initial_temperature = temperature
+        self.start()
+
+    def start(self):
+        self.temperature = self.initial_temperature
+
+    def update(self, iteration, accepted, improved):
+        return self.temperature
+
+
+class GeometricSchedule:
+    def __init__(self, initial_temperature=10.0, alpha=0.9995, min_temperature=0.1):
+        """
+        Initializes the GeometricSchedule object: T = max(min_temperature, initial_temperature * alpha^iteration).
+
+        Args:
+            initial_temperature (float, optional): The starting temperature. Defaults to 10.
+            alpha (float, optional): The cooling factor of every iteration. Defaults to 0.9995.
+            min_temperature (float, optional): The final temperature. Defaults to 0.1.
+        """
+        self.initial_temperature = initial_temperature
+        self.alpha = alpha
+        self.min_temperature = min_temperature
+        self.start()
+
+    def start(self):
+        self.temperature = self.initial_temperature
+
+    def update(self, iteration, accepted, improved):
+        self.temperature = max(self.min_temperature, self.temperature * self.alpha)
+        return self.temperature
+
+
+class AdaptiveSchedule:
+    def __init__(
+        self,
+        initial_temperature=10.0,
+        target_acceptance=0.05,
+        window=200,
+        factor=0.9,
+        min_temperature=0.1,
+    ):
+        """
+        Initializes the AdaptiveSchedule object: every window iterations the temperature is multiplied by factor
+        if the acceptance rate of the window was above target_acceptance, and divided by it otherwise,
+        so the chain cools as long as it moves easily and warms up when it gets stuck.
+
+        Args:
+            initial_temperature (float, optional): The starting temperature. Defaults to 10.
+            target_acceptance (float, optional): The target acceptance rate. Defaults to 0.05.
+            window (int, optional): The number of iterations between two updates. Defaults to 200.
+            factor (float, optional): The cooling factor of every update, in (0, 1). Defaults to 0.9.
+            min_temperature (float, optional): The minimum temperature. Defaults to 0.1.
+        """
+        self.initial_temperature = initial_temperature
+        self.target_acceptance = target_acceptance
+        self.window = window
+        self.factor = factor
+        self.min_temperature = min_temperature
+        self.start()
+
+    def start(self):
+        self.temperature = self.initial_temperature
+        self.n_accepted = 0
+        self.n_iterations = 0
+
+    def update(self, iteration, accepted, improved):
+        self.n_accepted += accepted
+        self.n_iterations += 1
+        if self.n_iterations == self.window:
+            if self.n_accepted / self.n_iterations > self.target_acceptance:
+                self.temperature = max(
+                    self.min_temperature, self.temperature * self.factor
+                )
+            else:
+                self.temperature = self.temperature / self.factor
+            self.n_accepted = 0
+            self.n_iterations = 0
+        return self.temperature
+
+
+class ReheatingSchedule:
+    def __init__(self, schedule, patience=5000):
+        """
+        Initializes the ReheatingSchedule object, which wraps another schedule and restarts it (reheating the chain
+        to its initial temperature) when the best log-likelihood has not improved for patience iterations.
+
+        Args:
+            schedule: The wrapped schedule, e.g. a GeometricSchedule.
+            patience (int, optional): The number of iterations without improvement before reheating. Defaults to 5000.
+        """
+        self.schedule = schedule
+        self.patience = patience
+        self.start()
+
+    def start(self):
+        self.schedule.start()
+        self.temperature = self.schedule.temperature
+        self.last_improvement = 0
+        self.n_reheats = 0
+
+    def update(self, iteration, accepted, improved):
+        if improved:
+            self.last_improvement = iteration
+        if iteration - self.last_improvement >= self.patience:
+            self.schedule.start()
+            self.last_improvement = iteration
+            self.n_reheats += 1
+            self.temperature = self.schedule.temperature
+        else:
+            self.temperature = self.schedule.update(iteration, accepted, improved)
+        return self.temperature
@@ -1,12 +1,34 @@
 import random
 import math
 from src.CipherUtils import TextDecoder
+from src.CipherHistory import CipherHistory
+from src.HMM_utils import string_to_codes
+from src.CipherScorer import (
+    CipherScorer,
+    cipher_to_decoding,
+    decoding_to_cipher,
+    decode_text,
+    random_decodings,
+    random_swaps,
+    _init_scorer_worker,
+    _tempered_segment,
+)
+import multiprocessing
+import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.animation import FuncAnimation
 
 
 class CipherBreaker:
-    def __init__(self, cipher_generator, ciphered_text, probability_table):
+    def __init__(
+        self,
+        cipher_generator,
+        ciphered_text,
+        probability_table,
+        ngram_model=None,
+        history_size=100,
+        trace_interval=None,
+    ):
         """
         Initializes the CipherBreaker object.
 
@@ -14,6 +36,11 @@ class CipherBreaker:
             cipher_generator (CypherGenerator Class): An object of the ciphergenerator class
             ciphered_text (str): The ciphered text.
             probability_table (dict): A probability table mapping two-character sequences to their probabilities.
+            ngram_model (NgramModel, optional): If given, the texts are scored with its n-grams (e.g. quadgrams)
+                instead of the bigrams of probability_table. Defaults to None.
+            history_size (int, optional): The number of best ciphers kept in the history. Defaults to 100.
+            trace_interval (int, optional): If given, one accepted cipher every trace_interval is kept in the trace
+                of the history (a ring buffer), used by generate_animation. Defaults to None.
         """
 
         self.cipher_generator = cipher_generator
@@ -22,14 +49,20 @@ class CipherBreaker:
         )  # Initialize the current cipher to a randomly generated one
         self.ciphered_text = ciphered_text
         self.probability_table = probability_table
+        self.ngram_model = ngram_model
+        self.scorer = None  # the CipherScorer of the ciphertext, built by get_scorer
+        self.stop_reason = None  # why the last run stopped, see StoppingCriteria
 
         self.decoder = TextDecoder()
 
-        # history will store all the deciphered messages and the first time we find them and the log-likelihood associated to those
-        # It is a dictionary with structure text : [first_iteration_found, log_likelihood]
-        self.history = {
-            self.ciphered_text: [0, self.get_log_likelihood(self.ciphered_text)]
-        }
+        # history will store the best ciphers and the first time we find them and the log-likelihood associated to those
+        # (see CipherHistory), starting from the identity cipher, which leaves the text as it is
+        self.history = CipherHistory(history_size, trace_interval)
+        self.history.add(
+            list("abcdefghijklmnopqrstuvwxyz"),
+            0,
+            self.get_log_likelihood(self.ciphered_text),
+        )
 
     def restart_cipher(self):
         """
@@ -53,7 +86,8 @@ class CipherBreaker:
 
     def get_log_likelihood(self, text):
         """
-        Calculates the log-likelihood of the given text based on a probability table.
+        Calculates the log-likelihood of the given text based on a probability table,
+        or on the n-gram model if one was given.
 
         Args:
             text (str): The input text.
@@ -61,6 +95,9 @@ class CipherBreaker:
         Returns:
             float: The log-likelihood of the text.
         """
+        if self.ngram_model is not None:
+            return self.ngram_model.score(string_to_codes(text))
+
         two_char_list = [text[i : i + 2] for i in range(len(text) - 1)]
         probabilities = [
             self.probability_table.get(two_char, 1 / len(self.probability_table))
@@ -69,17 +106,326 @@ class CipherBreaker:
         log_likelihood = sum(math.log(prob) for prob in probabilities)
         return log_likelihood
 
-    def break_cipher(self, iterations=10000, print_interval=20):
+    def get_scorer(self):
+        """
+        Returns the CipherScorer of the ciphertext, built once with the n-gram model if given, else with the probability table.
+        """
+        if self.scorer is None:
+            if self.ngram_model is not None:
+                self.scorer = CipherScorer.from_ngram_model(
+                    self.ciphered_text, self.ngram_model
+                )
+            else:
+                self.scorer = CipherScorer.from_probability_table(
+                    self.ciphered_text, self.probability_table
+                )
+        return self.scorer
+
+    def break_cipher_counts(
+        self, iterations=10000, print_interval=None, stopping=None, schedule=None
+    ):
+        """
+        Breaks the cipher with the same Metropolis iterations of break_cipher, but every permutation is scored
+        by the CipherScorer from the n-gram counts of the ciphertext, and the text is decoded only once at the end.
+        The log-likelihood of the current permutation is kept, so every iteration scores only the proposed one.
+        With a cooling schedule (see AnnealingSchedules) the run is a simulated annealing: a swap is accepted
+        with probability min(1, exp(delta / T)), T being the temperature of the schedule.
+        Only the best cipher is added to the best ciphers of the history, the accepted ones go to its trace (see trace_interval).
+
+        Args:
+            iterations (int, optional): The number of iterations to perform. Defaults to 10000.
+            print_interval (int, optional): The interval at which to print the decoded text (which requires decoding it).
+                Set to None to disable printing. Defaults to None.
+            stopping (StoppingCriteria, optional): The early stopping rules, see StoppingCriteria. The reason of the stop
+                is stored in self.stop_reason ("iterations" if all the iterations were performed). Defaults to None.
+            schedule (optional): The cooling schedule, e.g. GeometricSchedule(). Defaults to None (plain Metropolis, T = 1).
+
+        Returns:
+            list: The final deciphered cipher.
+        """
+        scorer = self.get_scorer()
+        temperature = 1.0
+        if schedule is not None:
+            schedule.start()
+            temperature = schedule.temperature
+        self.stop_reason = "iterations"
+        if stopping is not None:
+            stopping.start()
+        current = cipher_to_decoding(self.current_cipher)
+        current_log_likelihood = scorer.score(current)
+        best, best_log_likelihood, best_iteration = (
+            current.copy(),
+            current_log_likelihood,
+            0,
+        )
+
+        i = 0
+        for it in range(iterations):
+            x, y = random.sample(range(26), k=2)
+            proposed = current.copy()
+            proposed[x], proposed[y] = current[y], current[x]
+            proposed_log_likelihood = scorer.score(proposed)
+            delta = proposed_log_likelihood - current_log_likelihood
+            accepted = delta > 0 or random.random() < math.exp(delta / temperature)
+            improved = False
+
+            if accepted:
+                current, current_log_likelihood = proposed, proposed_log_likelihood
+                self.history.add_accepted(current, it, current_log_likelihood)
+
+                if print_interval is not None and i % print_interval == 0:
+                    print(f"Iter {i}: {decode_text(self.ciphered_text, current)}")
+                i += 1
+
+                if current_log_likelihood > best_log_likelihood:
+                    best, best_log_likelihood = current.copy(), current_log_likelihood
+                    best_iteration = it
+                    improved = True
+
+            if schedule is not None:
+                temperature = schedule.update(it, accepted, improved)
+
+            if stopping is not None and stopping.update(it, best_log_likelihood, i):
+                self.stop_reason = stopping.reason
+                break
+
+        self.current_cipher = decoding_to_cipher(current)
+        self.history.add(decoding_to_cipher(best), best_iteration, best_log_likelihood)
+        return decoding_to_cipher(best)
+
+    def break_cipher_chains(
+        self,
+        iterations=10000,
+        n_chains=256,
+        seed=None,
+        print_interval=None,
+        stopping=None,
+    ):
+        """
+        Breaks the cipher running n_chains independent Metropolis chains in lockstep, each one from a random permutation
+        (the vectorized version of break_cipher_nstart). The permutations are kept in an (n_chains, 27) array:
+        at every iteration a swap is proposed for all the chains, all the proposals are scored together
+        by CipherScorer.score_batch and accepted or rejected with one vector of uniforms.
+        Only the best cipher over all the chains is added to the best ciphers of the history; the trace (see trace_interval)
+        counts the accepted ciphers of all the chains and records the current state of the best chain.
+
+        Args:
+            iterations (int, optional): The number of iterations of every chain. Defaults to 10000.
+            n_chains (int, optional): The number of chains. Defaults to 256.
+            seed (int, optional): The seed of the random generator. Defaults to None.
+            print_interval (int, optional): The interval (in iterations) at which to print the best decoded text so far.
+                Set to None to disable printing. Defaults to None.
+            stopping (StoppingCriteria, optional): The early stopping rules, see StoppingCriteria; the agreement
+                is the fraction of the chains which have reached the best log-likelihood of all the chains. The reason of the stop
+                is stored in self.stop_reason ("iterations" if all the iterations were performed). Defaults to None.
+
+        Returns:
+            list: The best deciphered cipher.
+        """
+        scorer = self.get_scorer()
+        rng = np.random.default_rng(seed)
+        self.stop_reason = "iterations"
+        if stopping is not None:
+            stopping.start()
+        n_accepted = 0
+        chains = np.arange(n_chains)
+
+        current = random_decodings(n_chains, rng)
+        current_log_likelihood = scorer.score_batch(current)
+        best = current.copy()
+        best_log_likelihood = current_log_likelihood.copy()
+        best_iteration = np.zeros(n_chains, dtype=int)
+
+        for it in range(iterations):
+            x, y = random_swaps(n_chains, rng)
+            proposed = current.copy()
+            proposed[chains, x] = current[chains, y]
+            proposed[chains, y] = current[chains, x]
+            proposed_log_likelihood = scorer.score_batch(proposed)
+
+            # accept with probability min(1, exp(proposed - current))
+            accept = np.log(rng.random(n_chains)) < (
+                proposed_log_likelihood - current_log_likelihood
+            )
+            current[accept] = proposed[accept]
+            current_log_likelihood[accept] = proposed_log_likelihood[accept]
+            n_step_accepted = int(np.count_nonzero(accept))
+            n_accepted += n_step_accepted
+            if n_step_accepted:
+                chain = np.argmax(current_log_likelihood)
+                self.history.add_accepted(
+                    current[chain],
+                    it,
+                    float(current_log_likelihood[chain]),
+                    n_step_accepted,
+                )
+
+            improved = current_log_likelihood > best_log_likelihood
+            best[improved] = current[improved]
+            best_log_likelihood[improved] = current_log_likelihood[improved]
+            best_iteration[improved] = it
+
+            if print_interval is not None and it % print_interval == 0:
+                chain = np.argmax(best_log_likelihood)
+                print(f"Iter {it}: {decode_text(self.ciphered_text, best[chain])}")
+
+            if stopping is not None:
+                top = np.max(best_log_likelihood)
+                agreement = np.mean(best_log_likelihood >= top - 1e-9 * abs(top))
+                if stopping.update(
+                    it, top, n_accepted, n_chains, n_chains, float(agreement)
+                ):
+                    self.stop_reason = stopping.reason
+                    break
+
+        chain = np.argmax(best_log_likelihood)
+        self.current_cipher = decoding_to_cipher(best[chain])
+        self.history.add(
+            self.current_cipher,
+            int(best_iteration[chain]),
+            float(best_log_likelihood[chain]),
+        )
+        return self.current_cipher
+
+    def break_cipher_tempering(
+        self,
+        iterations=10000,
+        temperatures=None,
+        swap_interval=200,
+        processes=None,
+        seed=None,
+        print_interval=None,
+        stopping=None,
+    ):
+        """
+        Breaks the cipher with parallel tempering (replica exchange): one Metropolis chain per temperature runs
+        in a pool of processes, the chain at temperature T accepting a swap with probability min(1, exp(delta / T)).
+        Every swap_interval iterations the neighbouring chains propose to exchange their permutations,
+        which is accepted with probability min(1, exp((1 / T_k - 1 / T_k+1) * (score_k+1 - score_k))),
+        so the hot chains, which cross the low-likelihood regions, feed new modes to the chain at T = 1.
+        Every worker builds the CipherScorer of the text once, then only permutations and scores are exchanged.
+        Only the best cipher over all the chains is added to the best ciphers of the history; the trace (see trace_interval)
+        counts the accepted ciphers of the chain at T = 1 and records its state at the end of every exchange round.
+
+        Args:
+            iterations (int, optional): The number of iterations of every chain. Defaults to 10000.
+            temperatures (list, optional): The temperatures, the first one should be 1.
+                Defaults to 8 temperatures geometrically spaced from 1 to 10.
+            swap_interval (int, optional): The number of iterations between two exchange rounds. Defaults to 200.
+            processes (int, optional): The size of the pool. Defaults to min(number of temperatures, number of cores).
+            seed (int, optional): The seed of the random generators. Defaults to None.
+            print_interval (int, optional): The interval (in exchange rounds) at which to print the best decoded text so far.
+                Set to None to disable printing. Defaults to None.
+            stopping (StoppingCriteria, optional): The early stopping rules, see StoppingCriteria, checked after every
+                exchange round, the acceptance rate being the fraction of swaps accepted by the replicas. The reason of the stop
+                is stored in self.stop_reason ("iterations" if all the iterations were performed). Defaults to None.
+
+        Returns:
+            list: The best deciphered cipher.
+        """
+        if temperatures is None:
+            temperatures = np.geomspace(1, 10, 8)
+        betas = 1 / np.asarray(temperatures, dtype=float)
+        n_replicas = len(betas)
+        if processes is None:
+            processes = min(n_replicas, multiprocessing.cpu_count())
+
+        scorer = self.get_scorer()
+        rng = np.random.default_rng(seed)
+
+        decodings = list(random_decodings(n_replicas, rng))
+        log_likelihoods = [scorer.score(decoding) for decoding in decodings]
+        best_index = int(np.argmax(log_likelihoods))
+        best = decodings[best_index].copy()
+        best_log_likelihood, best_iteration = log_likelihoods[best_index], 0
+        n_accepted = 0
+        self.stop_reason = "iterations"
+        if stopping is not None:
+            stopping.start()
+
+        with multiprocessing.Pool(
+            processes,
+            initializer=_init_scorer_worker,
+            initargs=(self.ciphered_text, scorer.log_probabilities, scorer.n),
+        ) as pool:
+            n_rounds = -(-iterations // swap_interval)
+            for r in range(n_rounds):
+                n_steps = min(swap_interval, iterations - r * swap_interval)
+                segment_seeds = rng.integers(2**32, size=n_replicas)
+                tasks = [
+                    (
+                        decodings[k],
+                        log_likelihoods[k],
+                        betas[k],
+                        n_steps,
+                        int(segment_seeds[k]),
+                    )
+                    for k in range(n_replicas)
+                ]
+                results = pool.starmap(_tempered_segment, tasks)
+
+                decodings = [result[0] for result in results]
+                log_likelihoods = [result[1] for result in results]
+                n_accepted += sum(result[4] for result in results)
+                self.history.add_accepted(
+                    decodings[0],
+                    r * swap_interval + n_steps - 1,
+                    log_likelihoods[0],
+                    results[0][4],
+                )
+                for _, _, segment_best, segment_best_log_likelihood, _ in results:
+                    if segment_best_log_likelihood > best_log_likelihood:
+                        best = segment_best
+                        best_log_likelihood = segment_best_log_likelihood
+                        best_iteration = r * swap_interval + n_steps
+
+                # exchange the neighbouring replicas, alternating even and odd pairs
+                for k in range(r % 2, n_replicas - 1, 2):
+                    log_ratio = (betas[k] - betas[k + 1]) * (
+                        log_likelihoods[k + 1] - log_likelihoods[k]
+                    )
+                    if np.log(rng.random()) < log_ratio:
+                        decodings[k], decodings[k + 1] = decodings[k + 1], decodings[k]
+                        log_likelihoods[k], log_likelihoods[k + 1] = (
+                            log_likelihoods[k + 1],
+                            log_likelihoods[k],
+                        )
+
+                if print_interval is not None and r % print_interval == 0:
+                    print(f"Round {r}: {decode_text(self.ciphered_text, best)}")
+
+                if stopping is not None and stopping.update(
+                    r * swap_interval + n_steps - 1,
+                    best_log_likelihood,
+                    n_accepted,
+                    n_steps * n_replicas,
+                    n_chains=n_replicas,
+                ):
+                    self.stop_reason = stopping.reason
+                    break
+
+        self.current_cipher = decoding_to_cipher(best)
+        self.history.add(self.current_cipher, best_iteration, scorer.score(best))
+        return self.current_cipher
+
+    def break_cipher(self, iterations=10000, print_interval=20, stopping=None):
         """
         Breaks the cipher by performing iterations of swapping elements in the current cipher.
 
         Args:
             iterations (int, optional): The number of iterations to perform. Defaults to 10000.
             print_interval (int, optional): The interval at which to print the decoded text. Set to None to disable printing. Defaults to 20.
+            stopping (StoppingCriteria, optional): The early stopping rules, see StoppingCriteria. The reason of the stop
+                is stored in self.stop_reason ("iterations" if all the iterations were performed). Defaults to None.
 
         Returns:
             list: The final deciphered cipher.
         """
+        self.stop_reason = "iterations"
+        if stopping is not None:
+            stopping.start()
+        best_log_likelihood = -math.inf
+
         i = 0
         for it in range(iterations):
             proposed_cipher = self.swap(self.current_cipher.copy())
@@ -118,10 +464,21 @@ class CipherBreaker:
                 i += 1
 
                 # self.decoded_texts.append(decoded_text_proposed)  # Store decoded text
-                if self.history.get(decoded_text_proposed) == None:
-                    self.history[decoded_text_proposed] = [it, proposed_log_likelihood]
+                self.history.add(proposed_cipher, it, proposed_log_likelihood)
+
+            if stopping is not None:
+                best_log_likelihood = max(
+                    best_log_likelihood,
+                    current_log_likelihood,
+                    proposed_log_likelihood if accept else -math.inf,
+                )
+                if stopping.update(it, best_log_likelihood, i, n_evaluations=2):
+                    self.stop_reason = stopping.reason
+                    break
 
-    def break_cipher_nstart(self, iterations=10000, print_interval=20, nstart=1):
+    def break_cipher_nstart(
+        self, iterations=10000, print_interval=20, nstart=1, stopping=None
+    ):
         """
         Breaks the cipher by performing iterations of swapping elements in the current cipher.
         It uses nstart starting points instead of only one, to try and avoid the situation where we are stuck in one.
@@ -130,13 +487,23 @@ class CipherBreaker:
             iterations (int, optional): The number of iterations to perform in total. Defaults to 10000.
             print_interval (int, optional): The interval at which to print the decoded text. Set to None to disable printing. Defaults to 20.
             n_iter (int, optional): The number of randomly generated starting points.
+            stopping (StoppingCriteria, optional): The early stopping rules, see StoppingCriteria. When patience or the acceptance
+                rate stop a start, the next start begins; the agreement is ignored, the target and the budgets stop the whole run.
+                The reason of the last stop is stored in self.stop_reason. Defaults to None.
 
         Returns:
             list: The final deciphered cipher.
         """
+        if stopping is not None:
+            stopping.start()
+
         for s in range(nstart):
             i = 0
             self.restart_cipher()
+            best_log_likelihood = -math.inf
+            self.stop_reason = "iterations"
+            if stopping is not None:
+                stopping.restart_chain()
             for it in range(int(iterations / nstart)):
                 proposed_cipher = self.swap(self.current_cipher.copy())
 
@@ -172,36 +539,58 @@ class CipherBreaker:
 
                     # self.decoded_texts.append(decoded_text_proposed)  # Store decoded text
                     # In this case we keep the number of iterations in the last, could also store the mean or something else
-                    if self.history.get(decoded_text_proposed) == None:
-                        self.history[decoded_text_proposed] = [
-                            it,
-                            proposed_log_likelihood,
-                        ]
+                    self.history.add(proposed_cipher, it, proposed_log_likelihood)
+
+                if stopping is not None:
+                    best_log_likelihood = max(
+                        best_log_likelihood,
+                        current_log_likelihood,
+                        proposed_log_likelihood if accept else -math.inf,
+                    )
+                    if stopping.update(it, best_log_likelihood, i, n_evaluations=2):
+                        self.stop_reason = stopping.reason
+                        break
+
+            if self.stop_reason in ("target", "evaluations", "time"):
+                break
 
     def extract_best(self, n_extract=5, return_likelihood=False):
         """
         Extracts the n_extract decoded texts with the highest log-likelihood.
         If log_lik = True it returns a list of item value pairs
         """
-        sorted_dict = dict(
-            sorted(self.history.items(), key=lambda x: x[1][1], reverse=True)
-        )
+        # only the stored ciphers are decoded, best first; different ciphers can give the same text
+        # when some letters are missing from it, so the texts are deduplicated
+        best = {}
+        for cipher, value in self.history.best():
+            decoded_text = self.decoder.decode_text(self.ciphered_text, cipher)
+            if decoded_text not in best:
+                best[decoded_text] = value
+                if len(best) == n_extract:
+                    break
 
         if return_likelihood == True:
-            return list(sorted_dict.items())[:n_extract]
+            return list(best.items())
 
-        return list(sorted_dict.keys())[:n_extract]
+        return list(best.keys())
 
     def generate_animation(self, filename="cipher_iterations.gif"):
         """
         Generates an animation of the cipher breaking process and saves it as a GIF.
+        The frames are the ciphers of the trace of the history if it was recorded (see trace_interval),
+        otherwise the best ciphers in the order they were found.
         """
+        if self.history.trace:
+            ciphers = [list(cipher) for _, cipher, _ in self.history.trace]
+        else:
+            ciphers = [cipher for cipher, _ in self.history.in_order()]
+
         fig = plt.figure(figsize=(8, 6))  # Adjust the figure size as desired
 
         def update(i):
             plt.clf()
             # decoded_text = self.decoded_texts[i]
-            decoded_text = list(self.history.keys())[i]
+            decoded_text = self.decoder.decode_text(self.ciphered_text, ciphers[i])
             lines = []
             current_line = ""
             for word in decoded_text.split():
@@ -223,7 +612,7 @@ class CipherBreaker:
             plt.axis("off")
 
         anim = FuncAnimation(
-            fig, update, frames=len(self.history), interval=100
+            fig, update, frames=len(ciphers), interval=100
         )  # Decreased interval for faster animation
 
         if filename != "cipher_iterations.gif":
@@ -1,77 +1,141 @@
-import random
-import math
-from src.CipherUtils import TextDecoder, TextLik
 import multiprocessing
+from src.CipherScorer import (
+    CipherScorer,
+    cipher_to_decoding,
+    decoding_to_cipher,
+    decode_text,
+    _init_scorer_worker,
+    _candidates_segment,
+)
+import numpy as np
 
 """
 Class not used in any code
-    - implements a double swap (swap two letters instead of one)
-    - implements a in-parallel step inside break_cipher:
-        - two swap are done in parallel and then the best one is chosen
+    - implements a best-of-candidates step inside break_cipher:
+        - n_candidates swaps are scored at once and then the best one is proposed
+    - every process of the pool runs its own chain for sync_interval iterations per call (so the cost of a call
+      is hidden by the work it does), then all the chains restart from the best current one
+    - the pool of processes is created once and kept alive between calls of break_cipher:
+      every worker builds the CipherScorer of the ciphertext once, then only permutations and scores are exchanged
 """
 
 
 class CipherBreaker:
-    def __init__(self, starting_cipher, ciphered_text, probability_table):
+    def __init__(
+        self,
+        starting_cipher,
+        ciphered_text,
+        probability_table,
+        processes=None,
+        n_candidates=16,
+        sync_interval=500,
+    ):
+        """
+        Initializes the CipherBreaker object.
+
+        Args:
+            starting_cipher (list): The starting cipher.
+            ciphered_text (str): The ciphered text.
+            probability_table (dict): A probability table mapping two-character sequences to their probabilities.
+            processes (int, optional): The size of the pool, i.e. the number of chains. Defaults to the number of cores.
+            n_candidates (int, optional): The number of swaps evaluated at every iteration. Defaults to 16.
+            sync_interval (int, optional): The number of iterations every process runs between two synchronizations
+                of the chains. Defaults to 500.
+        """
         self.current_cipher = starting_cipher
         self.ciphered_text = ciphered_text
         self.probability_table = probability_table
 
-        self.decoder = TextDecoder()  # self.decoder.decode_text
-        self.lik = TextLik()  # self.lik.get_log_lik_text
-
-        self.decoded_texts = []  # List to store decoded text
-
-    def parallel_swap(self, x):
-        rand_indices = random.sample(range(len(x)), k=2)
-        x[rand_indices[0]], x[rand_indices[1]] = x[rand_indices[1]], x[rand_indices[0]]
-        return x
-
-    def evaluate_swap(self, swap):
-        proposed_cipher = swap(self.current_cipher.copy())
-
-        decoded_text_proposed = self.decoder.decode_text(
-            self.ciphered_text, proposed_cipher
+        self.scorer = CipherScorer.from_probability_table(
+            ciphered_text, probability_table
         )
-        proposed_log_likelihood = self.lik.get_log_lik_text(
-            decoded_text_proposed, self.probability_table
-        )
-
-        return proposed_cipher, decoded_text_proposed, proposed_log_likelihood
-
-    def break_cipher(self, iterations=10000, print_interval=20):
-        i = 0
-        for _ in range(iterations):
-            swap_pool = multiprocessing.Pool()
-            swaps = [self.parallel_swap] * multiprocessing.cpu_count()
-            results = swap_pool.map(self.evaluate_swap, swaps)
-            swap_pool.close()
-            swap_pool.join()
-
-            best_swap = max(results, key=lambda x: x[2])
-            proposed_cipher, decoded_text_proposed, proposed_log_likelihood = best_swap
-
-            decoded_text_current = self.decoder.decode_text(
-                self.ciphered_text, self.current_cipher
+        self.processes = multiprocessing.cpu_count() if processes is None else processes
+        self.n_candidates = n_candidates
+        self.sync_interval = sync_interval
+        self.pool = None  # created by start_pool, kept alive until close
+
+    def start_pool(self):
+        """
+        Creates the pool of processes, if not already running.
+        """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.processes,
+                initializer=_init_scorer_worker,
+                initargs=(self.ciphered_text, self.scorer.log_probabilities, 2),
             )
-            current_log_likelihood = self.lik.get_log_lik_text(
-                decoded_text_current, self.probability_table
-            )
-
-            acceptance_probability = min(
-                1, math.exp(proposed_log_likelihood - current_log_likelihood)
-            )
-
-            accept = random.choices(
-                [True, False],
-                weights=[acceptance_probability, 1 - acceptance_probability],
-                k=1,
-            )[0]
-
-            if accept:
-                self.current_cipher = proposed_cipher
-                if print_interval is not None and i % print_interval == 0:
-                    print(f"Iter {i}: {decoded_text_proposed}")
-                i += 1
 
-                self.decoded_texts.append(decoded_text_proposed)  # Store decoded text
+    def close(self):
+        """
+        Terminates the pool of processes.
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        self.start_pool()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def break_cipher(self, iterations=10000, print_interval=None, seed=None):
+        """
+        Breaks the cipher: at every iteration n_candidates random swaps of the current cipher are scored
+        and the best one is accepted with the Metropolis probability. Every process of the pool runs one such chain,
+        and every sync_interval iterations all the chains restart from the one with the highest log-likelihood.
+        If the pool is not running (see start_pool and the context manager) it is created for this call only.
+
+        Args:
+            iterations (int, optional): The number of iterations of every chain. Defaults to 10000.
+            print_interval (int, optional): The interval (in synchronizations) at which to print the decoded text.
+                Set to None to disable printing. Defaults to None.
+            seed (int, optional): The seed of the random generators. Defaults to None.
+
+        Returns:
+            list: The best deciphered cipher.
+        """
+        owns_pool = self.pool is None
+        self.start_pool()
+        rng = np.random.default_rng(seed)
+
+        current = cipher_to_decoding(self.current_cipher)
+        current_log_likelihood = self.scorer.score(current)
+        best, best_log_likelihood = current.copy(), current_log_likelihood
+
+        try:
+            n_rounds = -(-iterations // self.sync_interval)
+            for r in range(n_rounds):
+                n_steps = min(self.sync_interval, iterations - r * self.sync_interval)
+                segment_seeds = rng.integers(2**32, size=self.processes)
+                tasks = [
+                    (
+                        current,
+                        current_log_likelihood,
+                        n_steps,
+                        self.n_candidates,
+                        int(segment_seed),
+                    )
+                    for segment_seed in segment_seeds
+                ]
+                results = self.pool.starmap(_candidates_segment, tasks)
+
+                # all the chains restart from the best current state
+                current, current_log_likelihood = max(
+                    (result[:2] for result in results), key=lambda result: result[1]
+                )
+                for _, _, segment_best, segment_best_log_likelihood, _ in results:
+                    if segment_best_log_likelihood > best_log_likelihood:
+                        best = segment_best
+                        best_log_likelihood = segment_best_log_likelihood
+
+                if print_interval is not None and r % print_interval == 0:
+                    print(f"Round {r}: {decode_text(self.ciphered_text, best)}")
+        finally:
+            if owns_pool:
+                self.close()
+
+        self.current_cipher = decoding_to_cipher(current)
+        return decoding_to_cipher(best)
@@ -0,0 +1,100 @@
+import heapq
+from collections import deque
+
+from src.CipherScorer import decoding_to_cipher
+
+
+class CipherHistory:
+    def __init__(self, size=100, trace_interval=None, trace_size=1000):
+        """
+        Initializes the CipherHistory object, the bounded store of the ciphers found by CipherBreaker.
+
+        It keeps the size ciphers with the highest log-likelihood in a min-heap (so adding a cipher costs O(log size)
+        and the worst one is dropped when the store is full), each with the first iteration it was found at.
+        Ciphers are stored as strings of 26 letters, never as decoded texts, so memory does not depend
+        on the length of the text nor on the length of the run.
+        Optionally, one accepted cipher every trace_interval is also kept in a ring buffer of trace_size entries.
+
+        Args:
+            size (int, optional): The number of best ciphers kept. Defaults to 100.
+            trace_interval (int, optional): The sampling interval of the trace, in accepted ciphers. Defaults to None (no trace).
+            trace_size (int, optional): The maximum number of entries of the trace. Defaults to 1000.
+        """
+        self.size = size
+        self.trace_interval = trace_interval
+        self.heap = []  # min-heap of (log_likelihood, cipher)
+        # cipher -> [first_iteration, log_likelihood], for the ciphers in the heap
+        self.entries = {}
+        self.trace = deque(maxlen=trace_size)  # (iteration, cipher, log_likelihood)
+        self.n_accepted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, cipher, iteration, log_likelihood):
+        """
+        Records an accepted cipher.
+
+        Args:
+            cipher (list): The cipher (see CipherGenerator).
+            iteration (int): The iteration it was accepted at.
+            log_likelihood (float): Its log-likelihood.
+        """
+        key = "".join(cipher)
+        if (
+            self.trace_interval is not None
+            and self.n_accepted % self.trace_interval == 0
+        ):
+            self.trace.append((iteration, key, log_likelihood))
+        self.n_accepted += 1
+
+        if key in self.entries:
+            return
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (log_likelihood, key))
+        elif log_likelihood > self.heap[0][0]:
+            _, dropped = heapq.heapreplace(self.heap, (log_likelihood, key))
+            del self.entries[dropped]
+        else:
+            return
+        self.entries[key] = [iteration, log_likelihood]
+
+    def add_accepted(self, decoding, iteration, log_likelihood, n_accepted=1):
+        """
+        Records n_accepted ciphers accepted by a sampler working on decoding arrays (see CipherScorer),
+        the current state being decoding: it is converted to a cipher only when the trace reaches one of its
+        sampling points, so the other accepted ciphers cost O(1). The best cipher of such a run is added with add.
+
+        Args:
+            decoding (np.array): The current decoding array.
+            iteration (int): The iteration it was accepted at.
+            log_likelihood (float): Its log-likelihood.
+            n_accepted (int, optional): The number of ciphers accepted since the last call. Defaults to 1.
+        """
+        first = self.n_accepted
+        self.n_accepted += n_accepted
+        if self.trace_interval is not None:
+            next_sample = -(-first // self.trace_interval) * self.trace_interval
+            if next_sample < self.n_accepted:
+                key = "".join(decoding_to_cipher(decoding))
+                self.trace.append((iteration, key, log_likelihood))
+
+    def best(self, n=None):
+        """
+        Returns the n ciphers with the highest log-likelihood, best first, in O(size log size).
+
+        Args:
+            n (int, optional): The number of ciphers. Defaults to None (all the stored ones).
+
+        Returns:
+            list: The (cipher, [first_iteration, log_likelihood]) pairs, the cipher as a list of letters.
+        """
+        ranked = sorted(self.heap, reverse=True)[:n]
+        return [(list(key), self.entries[key]) for _, key in ranked]
+
+    def in_order(self):
+        """
+        Returns the stored ciphers in the order they were first found, as (cipher, [first_iteration, log_likelihood]) pairs.
+        """
+        ordered = sorted(self.entries.items(), key=lambda item: item[1][0])
+        return [(list(key), value) for key, value in ordered]
@@ -0,0 +1,261 @@
+import math
+
+from src.HMM_utils import string_to_codes
+from src.NgramModel import NgramModel
+import numpy as np
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz "
+
+
+def cipher_to_decoding(cipher):
+    """
+    Converts a cipher (the list of 26 letters used by TextEncoder and TextDecoder, where cipher[i] encodes
+    the i-th letter) to its decoding array, where decoding[c] is the code of the letter encoded by the code c.
+    The space (code 26) is decoded to itself.
+
+    Args:
+        cipher (list): The cipher.
+
+    Returns:
+        np.array: The decoding array, of 27 ints.
+    """
+    decoding = np.empty(27, dtype=np.intp)
+    decoding[[ord(char) - ord("a") for char in cipher]] = np.arange(26)
+    decoding[26] = 26
+    return decoding
+
+
+def decoding_to_cipher(decoding):
+    """
+    Converts a decoding array back to the cipher, see cipher_to_decoding.
+
+    Args:
+        decoding (np.array): The decoding array.
+
+    Returns:
+        list: The cipher.
+    """
+    cipher = [""] * 26
+    for code in range(26):
+        cipher[decoding[code]] = ALPHABET[code]
+    return cipher
+
+
+def decode_text(ciphered_text, decoding):
+    """
+    Decodes the text with the decoding array, as TextDecoder.decode_text does with the corresponding cipher.
+
+    Args:
+        ciphered_text (str): The ciphered text (lower case letters and spaces).
+        decoding (np.array): The decoding array.
+
+    Returns:
+        str: The decoded text.
+    """
+    alphabet = np.frombuffer(ALPHABET.encode(), dtype=np.uint8)
+    return alphabet[decoding[string_to_codes(ciphered_text)]].tobytes().decode()
+
+
+def log_probability_table(probability_table):
+    """
+    Converts the probability table of ProbabilityMatrix (a dict two characters -> probability)
+    to the 27 x 27 matrix of its logarithms, with -inf for the zero probabilities.
+
+    Args:
+        probability_table (dict): The probability table.
+
+    Returns:
+        np.array: The log-probability matrix.
+    """
+    log_matrix = np.full((27, 27), -np.inf)
+    for i, x in enumerate(ALPHABET):
+        for j, y in enumerate(ALPHABET):
+            probability = probability_table.get(x + y, 1 / len(probability_table))
+            if probability > 0:
+                log_matrix[i, j] = math.log(probability)
+    return log_matrix
+
+
+class CipherScorer:
+    def __init__(self, ciphered_text, log_probabilities, n=2):
+        """
+        Initializes the CipherScorer object, which computes the log-likelihood of the text decoded by a permutation
+        without decoding it.
+
+        The n-grams of the ciphertext are counted once: if the distinct n-grams are g_1, ..., g_m with counts w_1, ..., w_m,
+        the log-likelihood of the decoding d is sum_k w_k * log_probabilities[d(g_k)], so every evaluation costs O(m),
+        with m <= 27^n whatever the length of the ciphertext (for bigrams, the 27 x 27 count matrix).
+
+        Args:
+            ciphered_text (str): The ciphered text (lower case letters and spaces).
+            log_probabilities (np.array): The log-probabilities of the n-grams, an array of shape (27,) * n
+                or its flattened version (e.g. log_probability_table(...) or NgramModel.log_probabilities).
+            n (int, optional): The length of the n-grams. Defaults to 2.
+        """
+        self.n = n
+        self.log_probabilities = np.asarray(log_probabilities).reshape(-1)
+
+        indices = NgramModel.ngram_indices(string_to_codes(ciphered_text), n)
+        ngrams, self.weights = np.unique(indices, return_counts=True)
+
+        # self.ngrams[k] are the n codes of the k-th distinct n-gram of the ciphertext
+        self.ngrams = np.stack(np.unravel_index(ngrams, (27,) * n), axis=1)
+        self.powers = 27 ** np.arange(n - 1, -1, -1)
+
+    @classmethod
+    def from_probability_table(cls, ciphered_text, probability_table):
+        """
+        Returns the bigram scorer equivalent to CipherBreaker.get_log_likelihood with the given probability table.
+        """
+        return cls(ciphered_text, log_probability_table(probability_table), n=2)
+
+    @classmethod
+    def from_ngram_model(cls, ciphered_text, ngram_model):
+        """
+        Returns the scorer equivalent to NgramModel.score with the given model.
+        """
+        if ngram_model.log_probabilities is None:
+            ngram_model.compute_log_probabilities()
+        return cls(ciphered_text, ngram_model.log_probabilities, n=ngram_model.n)
+
+    def count_matrix(self):
+        """
+        Returns the dense count array of the ciphertext n-grams, of shape (27,) * n.
+        """
+        counts = np.zeros(27**self.n, dtype=np.int64)
+        counts[self.ngrams @ self.powers] = self.weights
+        return counts.reshape((27,) * self.n)
+
+    def score(self, decoding):
+        """
+        Returns the log-likelihood of the ciphertext decoded by the given decoding array.
+
+        Args:
+            decoding (np.array): The decoding array (see cipher_to_decoding).
+
+        Returns:
+            float: The log-likelihood.
+        """
+        decoded = decoding[self.ngrams] @ self.powers
+        return float(self.weights @ self.log_probabilities[decoded])
+
+    def score_batch(self, decodings):
+        """
+        Returns the log-likelihoods of the ciphertext decoded by many decoding arrays at once.
+
+        Args:
+            decodings (np.array): The decoding arrays, shape (n_chains, 27).
+
+        Returns:
+            np.array: The log-likelihoods, shape (n_chains,).
+        """
+        decoded = decodings[:, self.ngrams] @ self.powers
+        return self.log_probabilities[decoded] @ self.weights
+
+
+def random_decodings(n_chains, rng):
+    """
+    Returns n_chains random decoding arrays (random permutations of the 26 letters, the space decoded to itself).
+
+    Args:
+        n_chains (int): The number of decoding arrays.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        np.array: The decoding arrays, shape (n_chains, 27).
+    """
+    decodings = np.full((n_chains, 27), 26, dtype=np.intp)
+    decodings[:, :26] = rng.permuted(np.tile(np.arange(26), (n_chains, 1)), axis=1)
+    return decodings
+
+
+def random_swaps(n_chains, rng):
+    """
+    Draws, for every chain, two distinct codes among the 26 letters, uniformly.
+
+    Returns:
+        np.array: The first codes, shape (n_chains,).
+        np.array: The second codes, shape (n_chains,).
+    """
+    x = rng.integers(26, size=n_chains)
+    y = rng.integers(25, size=n_chains)
+    y += y >= x
+    return x, y
+
+
+# Functions needed by the worker processes of the parallel samplers
+
+# CipherScorer of the ciphertext, built once in every worker of the pool by _init_scorer_worker
+_worker_scorer = None
+
+
+def _init_scorer_worker(ciphered_text, log_probabilities, n):
+    global _worker_scorer
+    _worker_scorer = CipherScorer(ciphered_text, log_probabilities, n)
+
+
+def _tempered_segment(decoding, log_likelihood, beta, n_steps, seed):
+    """
+    Runs n_steps Metropolis swaps at inverse temperature beta (a swap is accepted with probability
+    min(1, exp(beta * delta))) with the scorer of the worker.
+    Only permutations and scores go through the pool, never the text.
+
+    Returns:
+        np.array: The final decoding array.
+        float: Its log-likelihood.
+        np.array: The best decoding array of the segment.
+        float: Its log-likelihood.
+        int: The number of accepted swaps.
+    """
+    rng = np.random.default_rng(seed)
+    x, y = random_swaps(n_steps, rng)
+    log_uniforms = np.log(rng.random(n_steps))
+
+    decoding = decoding.copy()
+    best, best_log_likelihood = decoding.copy(), log_likelihood
+    n_accepted = 0
+    for x_k, y_k, log_u in zip(x.tolist(), y.tolist(), log_uniforms.tolist()):
+        proposed = decoding.copy()
+        proposed[x_k], proposed[y_k] = decoding[y_k], decoding[x_k]
+        proposed_log_likelihood = _worker_scorer.score(proposed)
+        if beta * (proposed_log_likelihood - log_likelihood) > log_u:
+            decoding, log_likelihood = proposed, proposed_log_likelihood
+            n_accepted += 1
+            if log_likelihood > best_log_likelihood:
+                best, best_log_likelihood = decoding.copy(), log_likelihood
+    return decoding, log_likelihood, best, best_log_likelihood, n_accepted
+
+
+def _candidates_segment(decoding, log_likelihood, n_steps, n_candidates, seed):
+    """
+    Runs n_steps iterations of the best-of-candidates Metropolis chain of CipherBreakerNew with the scorer of the worker:
+    at every iteration n_candidates random swaps are scored at once with score_batch and the best one is accepted
+    with probability min(1, exp(delta)). Only permutations and scores go through the pool, never the text.
+
+    Returns:
+        np.array: The final decoding array.
+        float: Its log-likelihood.
+        np.array: The best decoding array of the segment.
+        float: Its log-likelihood.
+        int: The number of accepted swaps.
+    """
+    rng = np.random.default_rng(seed)
+    log_uniforms = np.log(rng.random(n_steps))
+    chains = np.arange(n_candidates)
+
+    decoding = decoding.copy()
+    best, best_log_likelihood = decoding.copy(), log_likelihood
+    n_accepted = 0
+    for log_u in log_uniforms.tolist():
+        x, y = random_swaps(n_candidates, rng)
+        proposed = np.tile(decoding, (n_candidates, 1))
+        proposed[chains, x] = decoding[y]
+        proposed[chains, y] = decoding[x]
+        proposed_log_likelihoods = _worker_scorer.score_batch(proposed)
+        k = np.argmax(proposed_log_likelihoods)
+        if proposed_log_likelihoods[k] - log_likelihood > log_u:
+            decoding, log_likelihood = proposed[k], float(proposed_log_likelihoods[k])
+            n_accepted += 1
+            if log_likelihood > best_log_likelihood:
+                best, best_log_likelihood = decoding.copy(), log_likelihood
+    return decoding, log_likelihood, best, best_log_likelihood, n_accepted
@@ -0,0 +1,215 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+# Streaming ingestion of the corpus: every file is split into byte ranges which are read and preprocessed
+# independently by a pool of processes (as TextPreProcessor does: lower case, every character outside a-z
+# becomes a space, multiple spaces are collapsed and the text is stripped), and every range is reduced
+# to a BigramShard. Shards merge associatively, so the counts of a file are exactly the ones of the whole
+# preprocessed file, while memory is bounded by processes * chunk_size.
+
+SPACE = 26
+
+# maps every byte of the lowered text to its code: a-z -> 0..25, anything else (non ASCII included) -> space
+_BYTE_CODES = np.full(256, SPACE, dtype=np.uint8)
+_BYTE_CODES[np.frombuffer(b"abcdefghijklmnopqrstuvwxyz", dtype=np.uint8)] = np.arange(
+    26, dtype=np.uint8
+)
+
+
+class BigramShard:
+    def __init__(
+        self,
+        counts=None,
+        first=None,
+        last=None,
+        leading_space=False,
+        trailing_space=False,
+    ):
+        """
+        Initializes the BigramShard object, the bigram counts of a piece of preprocessed text.
+
+        The leading and trailing spaces of the piece are kept apart from the counts, so that two shards can be
+        merged exactly: the bigrams across the boundary are added by merge, and the spaces at the two ends
+        of a whole file are dropped, as remove_additional_spaces does.
+
+        Args:
+            counts (np.array, optional): The 27 x 27 matrix of the bigram counts of the stripped text. Defaults to zeros.
+            first (int, optional): The code of the first character of the stripped text. Defaults to None (empty text).
+            last (int, optional): The code of the last character of the stripped text. Defaults to None (empty text).
+            leading_space (bool, optional): Whether the text starts with a space. Defaults to False.
+            trailing_space (bool, optional): Whether the text ends with a space. Defaults to False.
+        """
+        self.counts = np.zeros((27, 27), dtype=np.int64) if counts is None else counts
+        self.first = first
+        self.last = last
+        self.leading_space = leading_space
+        self.trailing_space = trailing_space
+
+    def is_empty(self):
+        """
+        Checks if the stripped text is empty, i.e. if the shard contains only spaces (or nothing).
+        """
+        return self.first is None
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Preprocesses and counts a piece of UTF-8 encoded text.
+
+        Args:
+            data (bytes): The text, starting and ending on character boundaries.
+
+        Returns:
+            BigramShard: The shard of the text.
+        """
+        text = data.decode("utf-8").lower().encode("ascii", errors="replace")
+        codes = _BYTE_CODES[np.frombuffer(text, dtype=np.uint8)]
+        if len(codes) == 0:
+            return cls()
+
+        is_space = codes == SPACE
+        if np.all(is_space):
+            return cls(leading_space=True, trailing_space=True)
+
+        # collapse the runs of spaces, then strip
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = ~(is_space[1:] & is_space[:-1])
+        codes = codes[keep].astype(np.intp)
+        leading_space = codes[0] == SPACE
+        trailing_space = codes[-1] == SPACE
+        codes = codes[int(leading_space) : len(codes) - int(trailing_space)]
+
+        counts = np.bincount(codes[:-1] * 27 + codes[1:], minlength=27**2)
+        return cls(
+            counts.reshape(27, 27),
+            int(codes[0]),
+            int(codes[-1]),
+            bool(leading_space),
+            bool(trailing_space),
+        )
+
+    def merge(self, other):
+        """
+        Merges the shard with the one of the text that follows it. The operation is associative,
+        so a file can be counted by merging the shards of its chunks in order, grouped in any way.
+
+        Args:
+            other (BigramShard): The shard of the following text.
+
+        Returns:
+            BigramShard: The shard of the concatenation of the two texts.
+        """
+        if self.is_empty() and other.is_empty():
+            space = self.leading_space or other.leading_space
+            return BigramShard(leading_space=space, trailing_space=space)
+        if self.is_empty():
+            return BigramShard(
+                other.counts.copy(),
+                other.first,
+                other.last,
+                self.leading_space or other.leading_space,
+                other.trailing_space,
+            )
+        if other.is_empty():
+            return BigramShard(
+                self.counts.copy(),
+                self.first,
+                self.last,
+                self.leading_space,
+                self.trailing_space or other.leading_space,
+            )
+
+        counts = self.counts + other.counts
+        if self.trailing_space or other.leading_space:
+            counts[self.last, SPACE] += 1
+            counts[SPACE, other.first] += 1
+        else:
+            counts[self.last, other.first] += 1
+        return BigramShard(
+            counts, self.first, other.last, self.leading_space, other.trailing_space
+        )
+
+    __add__ = merge
+
+
+def file_ranges(file_path, chunk_size):
+    """
+    Splits a file into byte ranges of about chunk_size bytes.
+
+    Returns:
+        list: The (file_path, start, end) tuples.
+    """
+    size = os.path.getsize(file_path)
+    return [
+        (file_path, start, min(start + chunk_size, size))
+        for start in range(0, size, chunk_size)
+    ]
+
+
+def _is_continuation(byte):
+    return byte & 0xC0 == 0x80
+
+
+def count_range(task):
+    """
+    Reads and counts the bytes [start, end) of a file. The range is moved forward to the next character boundary
+    at both ends, so that every UTF-8 character is counted by exactly one range.
+
+    Args:
+        task (tuple): The (file_path, start, end) tuple, as returned by file_ranges.
+
+    Returns:
+        BigramShard: The shard of the range.
+    """
+    file_path, start, end = task
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        # a UTF-8 character is at most 4 bytes long
+        data = file.read(end - start + 3)
+
+    begin = 0
+    while begin < len(data) and _is_continuation(data[begin]) and start > 0:
+        begin += 1
+    stop = end - start
+    while stop < len(data) and _is_continuation(data[stop]):
+        stop += 1
+    return BigramShard.from_bytes(data[begin:stop])
+
+
+def count_files(file_paths, chunk_size=2**22, processes=None):
+    """
+    Counts the bigrams of the preprocessed corpus made by the given files, reading them in chunks
+    with a pool of processes. Every file is preprocessed on its own, so there are no bigrams across two files.
+
+    Args:
+        file_paths (list): The paths of the corpus files (UTF-8 encoded).
+        chunk_size (int, optional): The size in bytes of the chunks. Defaults to 4 MiB.
+        processes (int, optional): The number of processes. Defaults to os.cpu_count(); with 1 no pool is started.
+
+    Returns:
+        np.array: The 27 x 27 matrix of the bigram counts.
+    """
+    ranges = [file_ranges(path, chunk_size) for path in file_paths]
+    tasks = [task for file_tasks in ranges for task in file_tasks]
+    n_ranges = [len(file_tasks) for file_tasks in ranges]
+
+    if processes == 1:
+        shards = map(count_range, tasks)
+        return _sum_files(shards, n_ranges)
+
+    with multiprocessing.Pool(processes) as pool:
+        # imap returns the shards in order, while only the (small) shards are kept in memory
+        shards = pool.imap(count_range, tasks)
+        return _sum_files(shards, n_ranges)
+
+
+def _sum_files(shards, n_ranges):
+    counts = np.zeros((27, 27), dtype=np.int64)
+    for n in n_ranges:
+        shard = BigramShard()
+        for _ in range(n):
+            shard = shard + next(shards)
+        counts += shard.counts
+    return counts
@@ -1,3 +1,5 @@
+import multiprocessing
+
 import numpy as np
 
 
@@ -8,26 +10,25 @@ def forward_HMM(A, B, pi, observed):
     pi: initial
     n_nodes: number of nodes in the chain
     observed: list containing observed ones.
+
+    Each time step is computed as one matrix-vector product between the
+    transition matrix and the previous scaled message.
     """
     n_nodes = len(observed)
     n_states = A.shape[0]
-    alpha = np.zeros((n_nodes, n_states))
     c = np.zeros(n_nodes)
     alpha_hat = np.zeros((n_nodes, n_states))
 
-    for j in range(n_states):
-        alpha[0, j] = pi[j] * B[j, observed[0]]
+    emissions = B[:, observed].T  # row i is the emission column of observed[i]
 
-    c[0] = np.sum(alpha[0])
-    alpha_hat[0] = alpha[0] / np.sum(alpha[0])
-    # print("alpa[0]", alpha[0])
+    alpha = pi * emissions[0]
+    c[0] = np.sum(alpha)
+    alpha_hat[0] = alpha / c[0]
 
     for i in range(1, n_nodes):
-        for j in range(n_states):
-            for k in range(n_states):
-                alpha[i, j] += A[k, j] * B[j, observed[i]] * alpha_hat[i - 1, k]
-        c[i] = np.sum(alpha[i])
-        alpha_hat[i] = alpha[i] / c[i]
+        alpha = emissions[i] * (alpha_hat[i - 1] @ A)
+        c[i] = np.sum(alpha)
+        alpha_hat[i] = alpha / c[i]
     return alpha_hat, c
 
 
@@ -37,23 +38,20 @@ def backward_HMM(A, B, observed, c):
     B: emission
     n_nodes: number of nodes in the chain
     observed: list containing observed ones.
+
+    Each time step is computed as one matrix-vector product between the
+    transition matrix and the next scaled message.
     """
     n_nodes = len(observed)
     n_states = A.shape[0]
-    beta = np.zeros((n_nodes - 1, n_states))
     beta_hat = np.zeros((n_nodes - 1, n_states))
 
-    for j in range(n_states):
-        for k in range(n_states):
-            beta[-1, j] += A[j, k] * B[k, observed[n_nodes - 1]]
+    emissions = B[:, observed].T
 
-    beta_hat[-1] = beta[-1] / c[-1]
+    beta_hat[-1] = (A @ emissions[n_nodes - 1]) / c[-1]
 
     for i in range(n_nodes - 3, -1, -1):
-        for j in range(n_states):
-            for k in range(n_states):
-                beta[i, j] += A[j, k] * B[k, observed[i + 1]] * beta_hat[i + 1, k]
-        beta_hat[i] = beta[i] / c[i + 1]
+        beta_hat[i] = (A @ (emissions[i + 1] * beta_hat[i + 1])) / c[i + 1]
 
     return beta_hat
 
@@ -85,30 +83,220 @@ def divide_row_by_sum(matrix):
     return divided_matrix
 
 
-def update_B(gamma, observed):
-    # n_nodes = gamma.shape[0]
+def expected_counts(gamma, observed, n_symbols=None):
+    """
+    gamma: conditional probabilities of the hidden states, one row per node
+    observed: list containing observed ones.
+    n_symbols: number of observable symbols (columns of B), defaults to the number of states.
+
+    Returns the expected number of times every hidden state emits every symbol.
+    It is a grouped sum of the rows of gamma by observed symbol,
+    computed with a single weighted bincount over the (symbol, state) pairs.
+    """
     n_states = gamma.shape[1]
+    if n_symbols is None:
+        n_symbols = n_states
 
-    B = np.zeros((n_states, n_states))
+    observed = np.asarray(observed)
+    pairs = observed[:, np.newaxis] * n_states + np.arange(n_states)
+    counts = np.bincount(
+        pairs.ravel(), weights=gamma.ravel(), minlength=n_symbols * n_states
+    )
+    return counts.reshape(n_symbols, n_states).T
 
-    for i in range(n_states):
-        for j in range(n_states):
-            for k in range(len(observed)):
-                if observed[k] == j:
-                    B[i, j] += gamma[k, i]
 
-    return divide_row_by_sum(B)
+def update_B(gamma, observed, n_symbols=None):
+    """
+    gamma: conditional probabilities of the hidden states, one row per node
+    observed: list containing observed ones.
+    n_symbols: number of observable symbols (columns of B), defaults to the number of states.
+    """
+    return divide_row_by_sum(expected_counts(gamma, observed, n_symbols))
+
+
+# Functions needed for the checkpointed forward-backward code
+
+
+def forward_HMM_checkpoints(A, B, pi, observed, segment_length):
+    """
+    Performs the forward pass of forward_HMM storing the scaled messages only at the start of every segment.
+    Input:
+        - A, B, pi, observed: as in forward_HMM
+        - segment_length (int): number of nodes between two checkpoints
+    Output:
+        - alpha_checkpoints: the scaled messages alpha_hat of the nodes 0, segment_length, 2 * segment_length, ...
+        - c_checkpoints: the normalization constants of the same nodes
+        - log_lik: the log-likelihood of the observed sequence (sum of the log of all the c)
+    """
+    n_nodes = len(observed)
+    n_segments = -(-n_nodes // segment_length)
+    alpha_checkpoints = np.zeros((n_segments, A.shape[0]))
+    c_checkpoints = np.zeros(n_segments)
+
+    alpha = pi * B[:, observed[0]]
+    c = np.sum(alpha)
+    alpha_hat = alpha / c
+    log_lik = np.log(c)
+    alpha_checkpoints[0], c_checkpoints[0] = alpha_hat, c
+
+    for i in range(1, n_nodes):
+        alpha = B[:, observed[i]] * (alpha_hat @ A)
+        c = np.sum(alpha)
+        alpha_hat = alpha / c
+        log_lik += np.log(c)
+        if i % segment_length == 0:
+            alpha_checkpoints[i // segment_length] = alpha_hat
+            c_checkpoints[i // segment_length] = c
+
+    return alpha_checkpoints, c_checkpoints, log_lik
+
 
+def iter_conditionals_checkpointed(
+    A, B, pi, observed, segment_length=None, checkpoints=None
+):
+    """
+    Computes the same gamma of forward_HMM + backward_HMM + compute_all_conditional keeping in memory
+    only one alpha_hat every segment_length nodes: during the backward sweep the forward messages
+    of every segment are recomputed from its checkpoint.
+    With segment_length = sqrt(n_nodes) (the default) the memory is O(sqrt(n_nodes) * n_states).
+    Input:
+        - A, B, pi, observed: as in forward_HMM
+        - segment_length (int): number of nodes between two checkpoints
+        - checkpoints: the output of forward_HMM_checkpoints, if it has already been computed
+    Output:
+        - a generator of (start, gamma_segment) pairs, from the last segment to the first one,
+          where gamma_segment contains the rows start, start + 1, ... of gamma
+    """
+    n_nodes = len(observed)
+    if segment_length is None:
+        segment_length = max(1, int(np.ceil(np.sqrt(n_nodes))))
+
+    if checkpoints is None:
+        checkpoints = forward_HMM_checkpoints(A, B, pi, observed, segment_length)
+    alpha_checkpoints, c_checkpoints, _ = checkpoints
+
+    beta_next = None  # beta_hat of the first node of the following segment
+    c_next = None  # c of the first node of the following segment
+
+    for segment in range(len(alpha_checkpoints) - 1, -1, -1):
+        start = segment * segment_length
+        stop = min(start + segment_length, n_nodes)
+
+        # recompute the forward messages of the segment from its checkpoint
+        alpha_hat = np.zeros((stop - start, A.shape[0]))
+        c = np.zeros(stop - start)
+        alpha_hat[0], c[0] = alpha_checkpoints[segment], c_checkpoints[segment]
+        for i in range(1, stop - start):
+            alpha = B[:, observed[start + i]] * (alpha_hat[i - 1] @ A)
+            c[i] = np.sum(alpha)
+            alpha_hat[i] = alpha / c[i]
+
+        # backward messages of the segment, the last node of the chain has beta_hat = 1
+        beta_hat = np.ones((stop - start, A.shape[0]))
+        for i in range(stop - start - 1, -1, -1):
+            if start + i < n_nodes - 1:
+                beta_hat[i] = (A @ (B[:, observed[start + i + 1]] * beta_next)) / c_next
+            beta_next, c_next = beta_hat[i], c[i]
+
+        gamma = alpha_hat * beta_hat
+        yield start, gamma / np.sum(gamma, axis=1, keepdims=True)
+
+
+def expected_counts_checkpointed(A, B, pi, observed, segment_length=None):
+    """
+    Computes the expected counts of the M step (see expected_counts) and the log-likelihood
+    with the checkpointed forward-backward of iter_conditionals_checkpointed.
+    """
+    if segment_length is None:
+        segment_length = max(1, int(np.ceil(np.sqrt(len(observed)))))
+    checkpoints = forward_HMM_checkpoints(A, B, pi, observed, segment_length)
+
+    counts = np.zeros((A.shape[0], B.shape[1]))
+    for start, gamma in iter_conditionals_checkpointed(
+        A, B, pi, observed, segment_length, checkpoints
+    ):
+        counts += expected_counts(
+            gamma, observed[start : start + len(gamma)], n_symbols=B.shape[1]
+        )
+    return counts, checkpoints[2]
+
+
+def log_likelihood(A, B, pi, observed):
+    """
+    Returns the log-likelihood of the observed sequence, i.e. the sum of the log of the
+    normalization constants c computed by forward_HMM.
+    """
+    alpha_hat, c = forward_HMM(A, B, pi, observed)
+    return np.sum(np.log(c))
+
+
+def Baum_Welch_step(A, B, pi, observed, checkpointed=False):
+    """
+    Performs one iteration (E step + M step) of the Baum-Welch algorithm.
+    If checkpointed is True the E step uses expected_counts_checkpointed, with O(sqrt(n_nodes)) memory.
+    Output:
+        - the updated emission matrix (before the constraints on the space are applied)
+        - the log-likelihood of the observed sequence under the input emission matrix B
+    """
+    if checkpointed:
+        counts, log_lik = expected_counts_checkpointed(A, B, pi, observed)
+        return divide_row_by_sum(counts), log_lik
+
+    alpha_hat, c = forward_HMM(A, B, pi, observed)
+    beta_hat = backward_HMM(A, B, observed, c)
+    gamma = compute_all_conditional(alpha_hat, beta_hat)
+    return update_B(gamma, observed, n_symbols=B.shape[1]), np.sum(np.log(c))
+
+
+def constrain_space(B):
+    """
+    Forces (in place) the space to be encrypted as itself: the last hidden state only emits the last symbol
+    and the last symbol is only emitted by the last hidden state. It also works on a batch of emission matrices.
+    """
+    B[..., -1, :] = 0
+    B[..., :, -1] = 0
+    B[..., -1, -1] = 1
+    return B
+
+
+def Baum_Welch(
+    A,
+    B_start,
+    pi,
+    observed,
+    maxIter=100,
+    tol=1e-4,
+    accelerate=False,
+    return_n_iter=False,
+    checkpointed=False,
+):
+    """
+    Estimates the emission matrix with the Baum-Welch (EM) algorithm.
+    Input:
+        - A: the transition matrix
+        - B_start: the starting emission matrix
+        - pi: the initial distribution
+        - observed: list containing observed ones.
+        - maxIter (int): maximum number of EM iterations (i.e. of calls to Baum_Welch_step)
+        - tol (float): the algorithm stops when no entry of B changes by more than tol
+        - accelerate (bool): if True uses the SQUAREM extrapolation (see Baum_Welch_squarem)
+        - return_n_iter (bool): if True also returns the number of EM iterations performed
+        - checkpointed (bool): if True the forward-backward passes store alpha only at sqrt(n_nodes)
+          checkpoints (see iter_conditionals_checkpointed), for very long ciphertexts
+    """
+    if accelerate:
+        B, n_iter = Baum_Welch_squarem(
+            A, B_start, pi, observed, maxIter, tol, checkpointed
+        )
+        return (B, n_iter) if return_n_iter else B
 
-def Baum_Welch(A, B_start, pi, observed, maxIter=100, tol=1e-4):
     B = np.copy(B_start)
     changed = 0  # change is set to 1 whenever at least one coordinate increases by more than tol
+    n_iter = 0
     for it in range(maxIter):
-        alpha_hat, c = forward_HMM(A, B, pi, observed)
-        beta_hat = backward_HMM(A, B, observed, c)
-        gamma = compute_all_conditional(alpha_hat, beta_hat)
         B_old = B
-        B = update_B(gamma, observed)
+        B, _ = Baum_Welch_step(A, B_old, pi, observed, checkpointed)
+        n_iter += 1
 
         # Check if conerged or still changing
         change = np.abs(B - B_old)
@@ -118,10 +306,345 @@ def Baum_Welch(A, B_start, pi, observed, maxIter=100, tol=1e-4):
             print("Not updating anymore after iteration", it)
             break
 
-        # following lines only for encryption
-        B[-1, :] = np.zeros(27)
-        B[:, -1] = np.zeros(27)
-        B[-1, -1] = 1
+        # following line only for encryption
+        constrain_space(B)
+    return (B, n_iter) if return_n_iter else B
+
+
+def Baum_Welch_squarem(
+    A, B_start, pi, observed, maxIter=100, tol=1e-4, checkpointed=False
+):
+    """
+    Baum-Welch accelerated with the SQUAREM scheme (Varadhan and Roland, 2008).
+    Every cycle performs two EM steps B0 -> B1 -> B2, extrapolates along the trajectory
+        B' = B0 - 2 * a * r + a^2 * v,   r = B1 - B0,   v = B2 - 2 * B1 + B0,   a = -max(1, |r| / |v|)
+    projects B' back on the row-stochastic matrices with the zero pattern of B1, and performs one more
+    EM step from B'. If the log-likelihood of B' is lower than the one of B1 the extrapolation is
+    discarded and the cycle restarts from B2, so the log-likelihood never decreases.
+    Output:
+        - B: the estimated emission matrix
+        - n_iter: the number of EM iterations performed
+    """
+    B = constrain_space(np.copy(B_start))
+    n_iter = 0
+    converged = False
+
+    def em_step(B_in):
+        nonlocal n_iter
+        n_iter += 1
+        B_out, current = Baum_Welch_step(A, B_in, pi, observed, checkpointed)
+        return B_out, current, np.max(np.abs(B_out - B_in)) < tol
+
+    while n_iter < maxIter:
+        B1, _, converged = em_step(B)
+        if converged or n_iter == maxIter:
+            B = B1
+            break
+        constrain_space(B1)
+
+        B2, log_lik_1, converged = em_step(B1)
+        if converged or n_iter == maxIter:
+            B = B2
+            break
+        constrain_space(B2)
+
+        r = B1 - B
+        v = B2 - 2 * B1 + B
+        step = -max(1.0, np.sqrt(np.sum(r**2) / max(np.sum(v**2), 1e-300)))
+        B_extrapolated = B - 2 * step * r + step**2 * v
+
+        # back to row-stochastic matrices with the same support as the EM iterates
+        B_extrapolated = np.where(B1 > 0, np.maximum(B_extrapolated, 1e-12), 0)
+        B_extrapolated = constrain_space(divide_row_by_sum(B_extrapolated))
+
+        B_next, log_lik_extrapolated, converged = em_step(B_extrapolated)
+        if log_lik_extrapolated < log_lik_1:
+            # monotonicity safeguard: fall back to the plain EM iterate
+            B = B2
+            converged = False
+            continue
+        B = B_next
+        if converged:
+            break
+        constrain_space(B)
+
+    if converged:
+        print("Not updating anymore after iteration", n_iter - 1)
+    return B, n_iter
+
+
+# Functions needed for the random-restart Baum-Welch code
+
+# shared array with the current log-likelihood of every restart, set in every worker of the pool
+_restart_log_likelihoods = None
+
+
+def _init_restart_worker(log_likelihoods):
+    global _restart_log_likelihoods
+    _restart_log_likelihoods = log_likelihoods
+
+
+def randomize_B(B_start, rng):
+    """
+    Returns a random emission matrix with the same zero pattern as B_start:
+    every entry of B_start is multiplied by an Exponential(1) weight and the rows are normalized.
+    """
+    B = B_start * rng.exponential(size=B_start.shape)
+    return divide_row_by_sum(B)
+
+
+def _Baum_Welch_restart(
+    A, B_start, pi, observed, maxIter, tol, margin, min_iter, index, seed
+):
+    """
+    Runs Baum_Welch from a randomized B_start, publishing its log-likelihood after every iteration in the
+    shared array and stopping early when it is more than margin below the best restart.
+    """
+    B = B_start if seed is None else randomize_B(B_start, np.random.default_rng(seed))
+    for it in range(maxIter):
+        B_old = B
+        B, current = Baum_Welch_step(A, B_old, pi, observed)
+
+        _restart_log_likelihoods[index] = current
+        if it >= min_iter and current < max(_restart_log_likelihoods[:]) - margin:
+            B = B_old
+            break
+
+        if np.max(np.abs(B - B_old)) < tol:
+            break
+
+        # following line only for encryption
+        constrain_space(B)
+
+    final = log_likelihood(A, B, pi, observed)
+    _restart_log_likelihoods[index] = final
+    return B, final
+
+
+def Baum_Welch_restarts(
+    A,
+    B_start,
+    pi,
+    observed,
+    n_restarts=8,
+    maxIter=100,
+    tol=1e-4,
+    processes=None,
+    margin=50.0,
+    min_iter=10,
+    seed=None,
+):
+    """
+    Runs Baum_Welch from n_restarts initializations across a process pool and keeps the best one.
+    The first run starts from B_start, the other ones from randomize_B(B_start).
+    Input:
+        - A, B_start, pi, observed, maxIter, tol: as in Baum_Welch
+        - n_restarts (int): number of initializations
+        - processes (int): size of the process pool, defaults to min(n_restarts, number of cores)
+        - margin (float): a run is cancelled once, after min_iter iterations, its log-likelihood is
+          more than margin below the best log-likelihood reached so far by any run
+        - seed (int): seed used to generate the random initializations
+    Output:
+        - B: the emission matrix with the highest final log-likelihood
+        - log_likelihoods: the final log-likelihood of every run
+    """
+    if processes is None:
+        processes = min(n_restarts, multiprocessing.cpu_count())
+
+    seeds = np.random.SeedSequence(seed).generate_state(n_restarts)
+    tasks = [
+        (
+            A,
+            B_start,
+            pi,
+            observed,
+            maxIter,
+            tol,
+            margin,
+            min_iter,
+            index,
+            None if index == 0 else int(seeds[index]),
+        )
+        for index in range(n_restarts)
+    ]
+
+    log_likelihoods = multiprocessing.Array("d", [-np.inf] * n_restarts)
+    with multiprocessing.Pool(
+        processes, initializer=_init_restart_worker, initargs=(log_likelihoods,)
+    ) as pool:
+        results = pool.starmap(_Baum_Welch_restart, tasks)
+
+    best = max(range(n_restarts), key=lambda index: results[index][1])
+    return results[best][0], [result[1] for result in results]
+
+
+# Functions needed for the batched Baum-Welch code
+
+
+def pad_observed(observed_list):
+    """
+    Stacks a list of observed sequences of different lengths into a padded array.
+    Input:
+        - observed_list: a list of observed sequences (lists of int)
+    Output:
+        - observed: an int array of shape (n_seqs, max_length), padded with 0
+        - mask: a boolean array of the same shape, True on the real (not padded) nodes
+    """
+    lengths = np.array([len(obs) for obs in observed_list])
+    observed = np.zeros((len(observed_list), lengths.max()), dtype=int)
+    mask = np.arange(lengths.max()) < lengths[:, np.newaxis]
+    observed[mask] = np.concatenate([np.asarray(obs) for obs in observed_list])
+    return observed, mask
+
+
+def emission_columns_batch(B, observed, mask):
+    """
+    Gathers the emission column of every observed symbol of a padded batch.
+    Input:
+        - B: the emission matrix, either shared (n_states, n_symbols) or one per sequence (n_seqs, n_states, n_symbols)
+        - observed, mask: the output of pad_observed
+    Output:
+        - emissions: an array of shape (n_seqs, max_length, n_states), equal to 1 on the padded nodes
+    """
+    if B.ndim == 2:
+        emissions = np.moveaxis(B[:, observed], 0, -1)
+    else:
+        emissions = np.take_along_axis(B, observed[:, np.newaxis, :], axis=2)
+        emissions = np.swapaxes(emissions, 1, 2)
+    emissions = np.array(emissions)
+    emissions[~mask] = 1
+    return emissions
+
+
+def forward_HMM_batch(A, emissions, pi):
+    """
+    Forward pass of forward_HMM run on a whole batch of sequences at once.
+    A: transition
+    emissions: output of emission_columns_batch
+    pi: initial
+
+    A padded node has emission 1 for every state, so it is an unobserved node of the chain:
+    since the rows of A sum to 1 its normalization constant is 1 and it leaves the real nodes untouched.
+    """
+    n_seqs, n_nodes, n_states = emissions.shape
+    c = np.zeros((n_seqs, n_nodes))
+    alpha_hat = np.zeros((n_seqs, n_nodes, n_states))
+
+    alpha = pi * emissions[:, 0]
+    c[:, 0] = np.sum(alpha, axis=1)
+    alpha_hat[:, 0] = alpha / c[:, 0, np.newaxis]
+
+    for i in range(1, n_nodes):
+        alpha = emissions[:, i] * (alpha_hat[:, i - 1] @ A)
+        c[:, i] = np.sum(alpha, axis=1)
+        alpha_hat[:, i] = alpha / c[:, i, np.newaxis]
+    return alpha_hat, c
+
+
+def backward_HMM_batch(A, emissions, c):
+    """
+    Backward pass of backward_HMM run on a whole batch of sequences at once.
+    A: transition
+    emissions: output of emission_columns_batch
+    c: normalization constants returned by forward_HMM_batch
+    """
+    n_seqs, n_nodes, n_states = emissions.shape
+    beta_hat = np.zeros((n_seqs, n_nodes - 1, n_states))
+
+    beta_hat[:, -1] = (emissions[:, -1] @ A.T) / c[:, -1, np.newaxis]
+
+    for i in range(n_nodes - 3, -1, -1):
+        beta_hat[:, i] = ((emissions[:, i + 1] * beta_hat[:, i + 1]) @ A.T) / c[
+            :, i + 1, np.newaxis
+        ]
+
+    return beta_hat
+
+
+def compute_all_conditional_batch(alpha, beta):
+    """
+    alpha: forward messages of a batch, shape (n_seqs, n_nodes, n_states)
+    beta: backward messages of a batch, shape (n_seqs, n_nodes - 1, n_states)
+    """
+    gamma = np.array(alpha)
+    gamma[:, :-1] *= beta
+    return gamma / np.sum(gamma, axis=2, keepdims=True)
+
+
+def update_B_batch(gamma, observed, mask, n_symbols, shared_key=False):
+    """
+    Batched version of update_B, the padded nodes are left out of the expected counts.
+    Input:
+        - gamma: output of compute_all_conditional_batch
+        - observed, mask: the output of pad_observed
+        - n_symbols: number of observable symbols (columns of B)
+        - shared_key: if True the counts of all the sequences are pooled in one emission matrix,
+          otherwise one emission matrix per sequence is returned
+    """
+    n_seqs, n_nodes, n_states = gamma.shape
+    symbols = observed[mask]
+    if not shared_key:
+        # every sequence gets its own block of n_symbols symbols
+        sequence = np.broadcast_to(np.arange(n_seqs)[:, np.newaxis], mask.shape)[mask]
+        symbols = sequence * n_symbols + symbols
+        n_groups = n_seqs * n_symbols
+    else:
+        n_groups = n_symbols
+
+    pairs = symbols[:, np.newaxis] * n_states + np.arange(n_states)
+    counts = np.bincount(
+        pairs.ravel(), weights=gamma[mask].ravel(), minlength=n_groups * n_states
+    )
+
+    if shared_key:
+        return divide_row_by_sum(counts.reshape(n_symbols, n_states).T)
+
+    B = np.swapaxes(counts.reshape(n_seqs, n_symbols, n_states), 1, 2)
+    return B / np.sum(B, axis=2, keepdims=True)
+
+
+def Baum_Welch_batch(
+    A, B_start, pi, observed_list, maxIter=100, tol=1e-4, shared_key=False
+):
+    """
+    Runs Baum_Welch on many observed sequences in one pass, padding them in a single batch.
+    Input:
+        - A: the transition matrix (rows must sum to 1)
+        - B_start: the starting emission matrix, shared (n_states, n_symbols) or one per sequence
+        - pi: the initial distribution
+        - observed_list: a list of observed sequences (lists of int)
+        - maxIter, tol: as in Baum_Welch, tol is checked on the largest change over the whole batch
+        - shared_key: if True all the messages are assumed to be encrypted with the same key and
+          one emission matrix is fitted on all of them, otherwise one per message
+    Output:
+        - B: the emission matrix (n_states, n_symbols) if shared_key, else an array (n_seqs, n_states, n_symbols)
+    """
+    observed, mask = pad_observed(observed_list)
+    n_seqs = observed.shape[0]
+
+    B = np.array(B_start, dtype=float)
+    if not shared_key and B.ndim == 2:
+        B = np.repeat(B[np.newaxis], n_seqs, axis=0)
+    n_symbols = B.shape[-1]
+
+    for it in range(maxIter):
+        emissions = emission_columns_batch(B, observed, mask)
+        alpha_hat, c = forward_HMM_batch(A, emissions, pi)
+        beta_hat = backward_HMM_batch(A, emissions, c)
+        gamma = compute_all_conditional_batch(alpha_hat, beta_hat)
+        B_old = B
+        B = update_B_batch(gamma, observed, mask, n_symbols, shared_key=shared_key)
+
+        # Check if conerged or still changing
+        change = np.abs(B - B_old)
+        max_change = np.max(change)
+
+        if max_change < tol:
+            print("Not updating anymore after iteration", it)
+            break
+
+        # following line only for encryption
+        constrain_space(B)
     return B
 
 
@@ -151,26 +674,28 @@ def compute_f_log(A, B, observed):
         - f: an array containig the all the other factors (n_states - 1)
     """
     pi = A[-1]
-    n_nodes = len(observed)
-    n_states = A.shape[0]
-    f = np.zeros((n_nodes - 1, n_states, n_states))
+    observed = np.asarray(observed)
 
-    tmp = np.zeros((n_states, 1))
-    for k in range(n_states):
-        tmp[k] = np.log(pi[k]) + np.log(B[k, observed[0]])
+    # log A is computed once and shared by all the factors
+    log_A = np.log(A)
+    log_B = np.log(B)
 
-    f0 = tmp
+    f0 = (np.log(pi) + log_B[:, observed[0]])[:, np.newaxis]
 
-    for i in range(1, n_nodes):
-        tmp = np.zeros((n_states, n_states))
+    # f[i - 1, j, k] = log A[j, k] + log B[k, observed[i]]
+    f = log_A[np.newaxis] + log_B[:, observed[1:]].T[:, np.newaxis, :]
 
-        for j in range(n_states):  # over z1
-            for k in range(n_states):  # over z2
-                tmp[j, k] = np.log(A[j, k]) + np.log(B[k, observed[i]])
+    return f0, f
 
-        f[i - 1] = tmp
 
-    return f0, f
+def backpointer_dtype(n_states):
+    """
+    Returns the smallest unsigned integer type able to store a state index, used for the backpointers of Viterbi.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_states <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
 
 
 def Viterbi_log(f0, f):
@@ -182,13 +707,14 @@ def Viterbi_log(f0, f):
     Output:
         - pmax: the array containing the messages of the forward pass
         - phi: the array storing the most probable preceding state stored during the forward pass
+          (as unsigned integers, see backpointer_dtype)
     """
     n_nodes = f.shape[0] + 1
     n_states = f.shape[1]
 
     pmax = np.zeros((n_nodes, n_states))  # Need one for every node
     phi = np.zeros(
-        (n_nodes - 1, n_states)
+        (n_nodes - 1, n_states), dtype=backpointer_dtype(n_states)
     )  # Need one for every node other than the first one (no need to reconstruct it)
 
     pmax[0] = f0.flatten()
@@ -205,6 +731,40 @@ def Viterbi_log(f0, f):
     return pmax, phi
 
 
+def Viterbi_log_stream(A, B, observed):
+    """
+    Performs the same forward pass of Viterbi_log without materializing the factors of compute_f_log.
+    log A is computed once and each step only adds the log emission column of the current observation,
+    so apart from the backpointers the memory does not grow with the length of the text.
+    Input:
+        - A : the transition matrix (its last row is used as initial distribution, as in compute_f_log)
+        - B : the emission matrix
+        - observed: an array containing the observed values
+    Output:
+        - pmax: the last message of the forward pass, with shape (1, n_states) so that it can be passed to reconstruct
+        - phi: the array storing the most probable preceding state stored during the forward pass
+          (as unsigned integers, see backpointer_dtype)
+    """
+    pi = A[-1]
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+
+    log_A = np.log(A)
+    log_B = np.log(B)
+
+    phi = np.zeros((n_nodes - 1, n_states), dtype=backpointer_dtype(n_states))
+
+    pmax = np.log(pi) + log_B[:, observed[0]]
+
+    for i in range(1, n_nodes):
+        tmp = (log_A + log_B[:, observed[i]]) + pmax[:, np.newaxis]
+
+        phi[i - 1] = np.argmax(tmp, axis=0)
+        pmax = np.max(tmp, axis=0)  # by column
+
+    return pmax[np.newaxis], phi
+
+
 def reconstruct(pmax, phi):
     """
     Given the output of a max-plus forward pass it returns the most probable hidden states.
@@ -214,13 +774,76 @@ def reconstruct(pmax, phi):
     Output:
         - An array of int that coincides with the most probable latent states
     """
-    reconstruction = np.empty(len(phi) + 1)
+    reconstruction = np.empty(len(phi) + 1, dtype=int)
 
     curr = np.argmax(pmax[-1])
     reconstruction[-1] = curr
 
     for i in range(len(phi) - 1, -1, -1):
-        curr = int(phi[i, curr])
+        curr = phi[i, curr]
         reconstruction[i] = curr
 
     return reconstruction
+
+
+def Viterbi_beam(A, B, observed, beam_width=None, threshold=None):
+    """
+    Beam-pruned version of Viterbi_log_stream, for models with many hidden states.
+    At every node only the beam_width states with the highest score and/or the states whose score is within
+    threshold of the best one survive, and the next messages are computed only from the rows of log A of the
+    surviving states, so every step costs O(n_survivors * n_states) instead of O(n_states^2).
+    Input:
+        - A : the transition matrix (its last row is used as initial distribution, as in compute_f_log)
+        - B : the emission matrix
+        - observed: an array containing the observed values
+        - beam_width (int): maximum number of surviving states per node
+        - threshold (float): maximum distance (in log-probability) of a surviving state from the best one
+    Output:
+        - reconstruction: an array of int with the decoded hidden states
+        - score: the log-probability of the decoded path
+        - error_bound: an upper bound of (exact Viterbi score - score), 0 means the decoded path is the exact one.
+          If the exact best path leaves the beam for the first time at node i in a pruned state k, its score is at
+          most (score of k at node i) + (sum over the next nodes of the best possible log A + log B), so the
+          exact score is at most the maximum of this quantity over the pruned states.
+    """
+    pi = A[-1]
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+
+    log_A = np.log(A)
+    log_B = np.log(B)
+
+    # best possible contribution of every node and of all the nodes after it, used for error_bound
+    best_step = np.max(log_B[:, observed].T + np.max(log_A, axis=0), axis=1)
+    best_future = np.append(np.cumsum(best_step[:0:-1])[::-1], 0)
+
+    def prune(scores):
+        keep = np.isfinite(scores)
+        if threshold is not None:
+            keep &= scores >= np.max(scores) - threshold
+        if beam_width is not None and np.count_nonzero(keep) > beam_width:
+            top = np.argpartition(np.where(keep, scores, -np.inf), -beam_width)
+            keep = np.zeros(n_states, dtype=bool)
+            keep[top[-beam_width:]] = True
+        pruned = np.isfinite(scores) & ~keep
+        return np.flatnonzero(keep), np.max(scores[pruned], initial=-np.inf)
+
+    phi = np.zeros((n_nodes - 1, n_states), dtype=backpointer_dtype(n_states))
+
+    pmax = np.log(pi) + log_B[:, observed[0]]
+    survivors, pruned_max = prune(pmax)
+    upper = pruned_max + best_future[0]
+
+    for i in range(1, n_nodes):
+        tmp = log_A[survivors] + pmax[survivors, np.newaxis]
+        best = np.argmax(tmp, axis=0)
+        phi[i - 1] = survivors[best]
+        pmax = tmp[best, np.arange(n_states)] + log_B[:, observed[i]]
+
+        survivors, pruned_max = prune(pmax)
+        upper = max(upper, pruned_max + best_future[i])
+
+    final = np.full(n_states, -np.inf)
+    final[survivors] = pmax[survivors]
+    score = np.max(final)
+    return reconstruct(final[np.newaxis], phi), score, max(upper - score, 0.0)
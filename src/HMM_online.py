@@ -0,0 +1,229 @@
+from collections import deque
+
+import numpy as np
+
+from src.HMM_functions import (
+    forward_HMM,
+    backward_HMM,
+    compute_all_conditional,
+    expected_counts,
+    divide_row_by_sum,
+    constrain_space,
+    backpointer_dtype,
+)
+
+
+class OnlineBaumWelch:
+    def __init__(self, A, B_start, pi, kappa=0.6, n_iter=5, lag=None):
+        """
+        Initializes the OnlineBaumWelch object, an online (stepwise) version of Baum_Welch
+        for a ciphertext which arrives chunk by chunk.
+
+        The sufficient statistics of B (the expected frequencies of every hidden state / symbol pair)
+        are updated after every chunk as
+            S = (1 - eta_k) * S + eta_k * s_k,     eta_k = (k + 2) ** (-kappa)
+        where s_k are the expected frequencies computed on the k-th chunk, and B is S normalized by row.
+        The symbols are decoded incrementally by an OnlineViterbi decoder, so the past symbols are not kept.
+
+        Args:
+            A (np.array): The transition matrix.
+            B_start (np.array): The starting emission matrix.
+            pi (np.array): The initial distribution of the first hidden state.
+            kappa (float, optional): The decay of the step size, in (0.5, 1]. Defaults to 0.6.
+            n_iter (int, optional): The number of E steps performed on every chunk, at least 1. Defaults to 5.
+            lag (int, optional): The maximum number of undecided states of the decoder, see OnlineViterbi.
+                Defaults to None (no limit).
+        """
+        if n_iter < 1:
+            raise ValueError(f"n_iter must be at least 1, got {n_iter}")
+        self.A = A
+        self.kappa = kappa
+        self.n_iter = n_iter
+
+        self.B = constrain_space(np.copy(B_start))
+        self.statistics = self.B / self.B.shape[0]
+        self.n_chunks = 0
+
+        # distribution of the hidden state of the first node of the next chunk
+        self.state = pi
+        # symbols received since the last call to decode, and the decoder which carries the Viterbi message across chunks
+        self.pending = []
+        self.decoder = OnlineViterbi(A, self.B, lag)
+
+    def chunk_statistics(self, chunk, B):
+        """
+        Computes the expected frequencies of the hidden state / symbol pairs on one chunk.
+
+        Args:
+            chunk (list): The observed symbols of the chunk.
+            B (np.array): The emission matrix used in the E step.
+
+        Returns:
+            np.array: The expected frequencies.
+            np.array: The filtered distribution of the hidden state of the last node of the chunk.
+        """
+        alpha_hat, c = forward_HMM(self.A, B, self.state, chunk)
+        if len(chunk) > 1:
+            beta_hat = backward_HMM(self.A, B, chunk, c)
+            gamma = compute_all_conditional(alpha_hat, beta_hat)
+        else:
+            gamma = alpha_hat
+
+        counts = expected_counts(gamma, chunk, n_symbols=B.shape[1])
+        return counts / len(chunk), alpha_hat[-1]
+
+    def update(self, chunk):
+        """
+        Updates the emission matrix with a new chunk of observed symbols.
+        An empty chunk (e.g. an empty read of a live stream) leaves the emission matrix unchanged.
+
+        Args:
+            chunk (list): The observed symbols of the chunk.
+
+        Returns:
+            np.array: The current emission matrix.
+        """
+        chunk = list(chunk)
+        if len(chunk) == 0:
+            return self.B
+        step_size = (self.n_chunks + 2) ** (-self.kappa)
+
+        B = self.B
+        for _ in range(self.n_iter):
+            counts, last_state = self.chunk_statistics(chunk, B)
+            statistics = (1 - step_size) * self.statistics + step_size * counts
+            B = constrain_space(divide_row_by_sum(statistics))
+
+        self.statistics = statistics
+        self.B = B
+        self.state = last_state @ self.A
+        self.pending.extend(chunk)
+        self.n_chunks += 1
+        return self.B
+
+    def decode(self):
+        """
+        Decodes the symbols received since the last call with the current emission matrix, continuing the Viterbi
+        forward message of the previous calls (see OnlineViterbi), so the cost only depends on the new symbols.
+        The states already returned are not revised when the emission matrix changes.
+
+        Returns:
+            np.array: The hidden states decided by the new symbols (possibly fewer than the new symbols), in order.
+        """
+        self.decoder.set_emission(self.B)
+        decided = [self.decoder.push(symbol) for symbol in self.pending]
+        self.pending = []
+        return np.concatenate(decided) if decided else np.empty(0, dtype=int)
+
+    def flush(self):
+        """
+        Decodes the remaining symbols and decides all the pending states, e.g. at the end of the stream.
+
+        Returns:
+            np.array: The hidden states not returned yet by decode, in order.
+        """
+        return np.concatenate([self.decode(), self.decoder.flush()])
+
+
+class OnlineViterbi:
+    def __init__(self, A, B, lag=None):
+        """
+        Initializes the OnlineViterbi object, a Viterbi decoder for a ciphertext which arrives symbol by symbol.
+
+        A decoded state is emitted as soon as the survivor paths of all the current states merge before it
+        (traceback convergence), in which case it is the same state found by Viterbi_log on the whole sequence.
+        If lag is given at most lag states are kept undecided: when there are more, the oldest ones are decided
+        following the path of the currently most probable state (fixed-lag decoding), so memory is O(lag * n_states).
+
+        Args:
+            A (np.array): The transition matrix (its last row is used as initial distribution, as in compute_f_log).
+            B (np.array): The emission matrix, e.g. the output of Baum_Welch.
+            lag (int, optional): The maximum number of undecided states. Defaults to None (no limit).
+        """
+        self.log_A = np.log(A)
+        self.log_B = np.log(B)
+        self.log_pi = np.log(A[-1])
+        self.lag = lag
+        self.n_states = A.shape[0]
+
+        self.pmax = None  # current forward message, shifted so that its maximum is 0
+        self.backpointers = deque()  # backpointers of the undecided nodes, oldest first
+
+    def set_emission(self, B):
+        """
+        Replaces the emission matrix used for the next symbols, e.g. after an update of OnlineBaumWelch.
+        """
+        self.log_B = np.log(B)
+
+    def push(self, symbol):
+        """
+        Processes one observed symbol.
+
+        Args:
+            symbol (int): The observed symbol.
+
+        Returns:
+            np.array: The hidden states decided after this symbol (possibly none), in order.
+        """
+        if self.pmax is None:
+            self.pmax = self.log_pi + self.log_B[:, symbol]
+        else:
+            tmp = (self.log_A + self.log_B[:, symbol]) + self.pmax[:, np.newaxis]
+            self.backpointers.append(
+                np.argmax(tmp, axis=0).astype(backpointer_dtype(self.n_states))
+            )
+            self.pmax = np.max(tmp, axis=0)
+        self.pmax = self.pmax - np.max(self.pmax)
+
+        decided = self.converged_states()
+        if self.lag is not None and len(self.backpointers) + 1 > self.lag:
+            n_forced = len(self.backpointers) + 1 - self.lag
+            states = self.traceback(np.argmax(self.pmax), len(self.backpointers))
+            decided = np.concatenate([decided, states[:n_forced]])
+            self.drop(n_forced)
+        return decided
+
+    def converged_states(self):
+        """
+        Finds the most recent node where the survivor paths of all the current states merge
+        and returns the states of the undecided nodes up to it.
+        """
+        survivors = np.arange(self.n_states)
+        for k in range(len(self.backpointers) - 1, -1, -1):
+            survivors = self.backpointers[k][survivors]
+            if survivors.min() == survivors.max():
+                states = self.traceback(survivors[0], k)
+                self.drop(k + 1)
+                return states
+        return np.empty(0, dtype=int)
+
+    def traceback(self, state, k):
+        """
+        Returns the states of the oldest k + 1 undecided nodes on the path ending in state at the (k + 1)-th node.
+        """
+        states = np.empty(k + 1, dtype=int)
+        states[k] = state
+        for j in range(k - 1, -1, -1):
+            states[j] = self.backpointers[j][states[j + 1]]
+        return states
+
+    def drop(self, n):
+        """
+        Forgets the oldest n undecided nodes, once they have been decided.
+        """
+        for _ in range(n):
+            self.backpointers.popleft()
+
+    def flush(self):
+        """
+        Decides all the remaining nodes following the most probable current state, as reconstruct does at the end of the text.
+
+        Returns:
+            np.array: The hidden states of the remaining nodes.
+        """
+        if self.pmax is None:
+            return np.empty(0, dtype=int)
+        states = self.traceback(np.argmax(self.pmax), len(self.backpointers))
+        self.pmax = None
+        self.backpointers.clear()
+        return states
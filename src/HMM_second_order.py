@@ -0,0 +1,154 @@
+import numpy as np
+
+from src.HMM_functions import update_B, constrain_space, backpointer_dtype
+
+# Second-order HMM: every hidden letter depends on the previous two.
+# It is run as a first-order HMM whose states are the pairs (previous letter, current letter),
+# but the 729 x 729 pair-to-pair transition matrix is never built: the pair (i, j) can only move to
+# a pair (j, k), so all the transitions are stored in the trigram tensor T[i, j, k] = P(k | i, j)
+# (see ProbabilityMatrix.compute_trigram_tensor), which only has 27^3 entries.
+# The first transition, which has only one previous letter, uses the bigram matrix A.
+
+
+def forward_HMM2(T, A, B, pi, observed):
+    """
+    T: trigram tensor
+    A: transition (used for the second node)
+    B: emission
+    pi: initial
+    observed: list containing observed ones (at least two).
+
+    Output:
+        - alpha0_hat: the scaled message of the first node, shape (n_states,)
+        - alpha_hat: the scaled messages of the pair states of the other nodes, shape (n_nodes - 1, n_states, n_states)
+          where alpha_hat[i - 1, j, k] refers to the letters j, k at nodes i - 1, i
+        - c: the normalization constants
+    """
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+    c = np.zeros(n_nodes)
+    alpha_hat = np.zeros((n_nodes - 1, n_states, n_states))
+
+    alpha = pi * B[:, observed[0]]
+    c[0] = np.sum(alpha)
+    alpha0_hat = alpha / c[0]
+
+    alpha = alpha0_hat[:, np.newaxis] * A * B[:, observed[1]]
+    c[1] = np.sum(alpha)
+    alpha_hat[0] = alpha / c[1]
+
+    for i in range(2, n_nodes):
+        alpha = np.einsum("ij,ijk->jk", alpha_hat[i - 2], T) * B[:, observed[i]]
+        c[i] = np.sum(alpha)
+        alpha_hat[i - 1] = alpha / c[i]
+    return alpha0_hat, alpha_hat, c
+
+
+def backward_HMM2(T, A, B, observed, c):
+    """
+    T: trigram tensor
+    A: transition (used for the second node)
+    B: emission
+    observed: list containing observed ones (at least two).
+    c: the normalization constants computed by forward_HMM2
+
+    Output:
+        - beta0_hat: the scaled message of the first node, shape (n_states,)
+        - beta_hat: the scaled messages of the pair states of the other nodes, shape (n_nodes - 1, n_states, n_states)
+    """
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+    beta_hat = np.ones((n_nodes - 1, n_states, n_states))
+
+    for i in range(n_nodes - 3, -1, -1):
+        message = B[:, observed[i + 2]] * beta_hat[i + 1]
+        beta_hat[i] = np.einsum("ijk,jk->ij", T, message) / c[i + 2]
+
+    beta0_hat = np.sum(A * B[:, observed[1]] * beta_hat[0], axis=1) / c[1]
+    return beta0_hat, beta_hat
+
+
+def compute_all_conditional2(alpha0, alpha, beta0, beta):
+    """
+    Returns the conditional probabilities of the hidden letter of every node, shape (n_nodes, n_states),
+    marginalizing the previous letter out of the pair states.
+    """
+    gamma = np.zeros((alpha.shape[0] + 1, alpha.shape[1]))
+
+    tmp = alpha0 * beta0
+    gamma[0] = tmp / np.sum(tmp)
+
+    tmp = np.sum(alpha * beta, axis=1)
+    gamma[1:] = tmp / np.sum(tmp, axis=1, keepdims=True)
+    return gamma
+
+
+def Baum_Welch2(T, A, B_start, pi, observed, maxIter=100, tol=1e-4):
+    """
+    Baum_Welch for the second-order HMM: only the emission matrix is estimated.
+    Input:
+        - T: the trigram tensor
+        - A: the transition matrix (used for the second node)
+        - B_start, pi, observed, maxIter, tol: as in Baum_Welch
+    """
+    B = np.copy(B_start)
+    for it in range(maxIter):
+        alpha0_hat, alpha_hat, c = forward_HMM2(T, A, B, pi, observed)
+        beta0_hat, beta_hat = backward_HMM2(T, A, B, observed, c)
+        gamma = compute_all_conditional2(alpha0_hat, alpha_hat, beta0_hat, beta_hat)
+        B_old = B
+        B = update_B(gamma, observed, n_symbols=B_old.shape[1])
+
+        # Check if conerged or still changing
+        change = np.abs(B - B_old)
+        max_change = np.max(change)
+
+        if max_change < tol:
+            print("Not updating anymore after iteration", it)
+            break
+
+        # following line only for encryption
+        constrain_space(B)
+    return B
+
+
+def Viterbi_log2(T, A, B, observed):
+    """
+    Performs the max plus algorithm (Viterbi) for the second-order HMM, working directly with the logarithms
+    of T, A and B as Viterbi_log_stream does.
+    Input:
+        - T: the trigram tensor
+        - A: the transition matrix (its last row is used as initial distribution, as in compute_f_log)
+        - B: the emission matrix
+        - observed: an array containing the observed values (at least two)
+    Output:
+        - An array of int that coincides with the most probable latent states
+    """
+    pi = A[-1]
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+
+    log_T = np.log(T)
+    log_B = np.log(B)
+
+    # phi[i - 2, j, k] is the most probable letter at node i - 2 given the letters j, k at nodes i - 1, i
+    phi = np.zeros((n_nodes - 2, n_states, n_states), dtype=backpointer_dtype(n_states))
+
+    pmax = (np.log(pi) + log_B[:, observed[0]])[:, np.newaxis] + (
+        np.log(A) + log_B[:, observed[1]]
+    )
+
+    for i in range(2, n_nodes):
+        tmp = pmax[:, :, np.newaxis] + log_T
+        phi[i - 2] = np.argmax(tmp, axis=0)
+        pmax = np.max(tmp, axis=0) + log_B[:, observed[i]]
+
+    reconstruction = np.empty(n_nodes, dtype=int)
+    reconstruction[-2], reconstruction[-1] = np.unravel_index(
+        np.argmax(pmax), pmax.shape
+    )
+
+    for i in range(n_nodes - 3, -1, -1):
+        reconstruction[i] = phi[i, reconstruction[i + 1], reconstruction[i + 2]]
+
+    return reconstruction
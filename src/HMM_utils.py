@@ -1,5 +1,7 @@
 import string
 
+import numpy as np
+
 
 def map_alphabet_to_numbers():
     """
@@ -28,6 +30,31 @@ def string_to_numbers(text, mapping):
     return numbers
 
 
+def string_to_codes(text):
+    """
+    Converts a string of characters to an array of codes (a -> 0, ..., z -> 25, " " -> 26).
+    It gives the same numbers as string_to_numbers with map_alphabet_to_numbers(), but it works on the
+    whole text at once through a lookup table on its bytes.
+
+    Args:
+        text (str): The input string to be converted.
+
+    Returns:
+        np.array: An array of uint8 representing the characters in the input string.
+
+    Raises:
+        KeyError: If the text contains a character outside the alphabet.
+    """
+    alphabet = "abcdefghijklmnopqrstuvwxyz "
+    lookup = np.full(256, 255, dtype=np.uint8)
+    lookup[np.frombuffer(alphabet.encode(), dtype=np.uint8)] = np.arange(len(alphabet))
+
+    codes = lookup[np.frombuffer(text.encode(), dtype=np.uint8)]
+    if np.any(codes == 255):
+        raise KeyError(next(char for char in text if char not in alphabet))
+    return codes
+
+
 def find_mapping(L):
     """
     Creates a mapping between indices and characters based on the given list of numbers.
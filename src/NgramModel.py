@@ -0,0 +1,164 @@
+from src.HMM_utils import string_to_codes
+from src.SharedModel import save_arrays, open_arrays
+import numpy as np
+
+
+class NgramModel:
+    def __init__(self, text, n=4, smoothing=0.5):
+        """
+        Initializes the NgramModel object, a character n-gram model of the provided text used to score
+        the decoded texts in CipherBreaker (trigrams for n=3, quadgrams for n=4).
+
+        The model is a dense array of 27^n log-probabilities indexed by the codes of the n characters
+        (a -> 0, ..., z -> 25, " " -> 26), so a whole text is scored with a single vectorized lookup.
+
+        Args:
+            text (str): The input text, preprocessed as for ProbabilityMatrix.
+            n (int, optional): The length of the n-grams. Defaults to 4.
+            smoothing (float, optional): The pseudo-count added to every n-gram (additive smoothing),
+                so that n-grams missing from the text get a finite log-probability. Defaults to 0.5.
+        """
+        self.text = text
+        self.n = n
+        self.smoothing = smoothing
+        self.counts = None  # store the 27^n counts, flattened
+        self.log_probabilities = None  # store the 27^n log-probabilities, flattened
+
+    @staticmethod
+    def ngram_indices(codes, n):
+        """
+        Returns the index of every n-gram of the codes in the flattened 27^n arrays,
+        i.e. the number written by its n codes in base 27.
+
+        Args:
+            codes (np.array): The codes of the text (see HMM_utils.string_to_codes).
+            n (int): The length of the n-grams.
+
+        Returns:
+            np.array: An array of len(codes) - n + 1 indices.
+        """
+        codes = np.asarray(codes, dtype=np.intp)
+        n_ngrams = len(codes) - n + 1
+        indices = np.zeros(max(n_ngrams, 0), dtype=np.intp)
+        for k in range(n):
+            indices = indices * 27 + codes[k : k + n_ngrams]
+        return indices
+
+    def compute_counts(self):
+        """
+        Computes the counts of all the n-grams of the text with a single bincount.
+        """
+        codes = string_to_codes(self.text)
+        self.counts = np.bincount(
+            self.ngram_indices(codes, self.n), minlength=27**self.n
+        )
+
+    def compute_log_probabilities(self):
+        """
+        Computes the smoothed log-probability of every n-gram, i.e. log((count + smoothing) / (total + smoothing * 27^n)).
+        """
+        if self.counts is None:
+            self.compute_counts()
+
+        smoothed = self.counts + self.smoothing
+        self.log_probabilities = np.log(smoothed / smoothed.sum())
+
+    def get_log_probability(self, ngram):
+        """
+        Returns the log-probability of a single n-gram.
+
+        Args:
+            ngram (str): The n characters.
+
+        Returns:
+            float: The log-probability of the n-gram.
+        """
+        if self.log_probabilities is None:
+            self.compute_log_probabilities()
+        index = self.ngram_indices(string_to_codes(ngram), self.n)[0]
+        return self.log_probabilities[index]
+
+    def score(self, codes):
+        """
+        Returns the log-likelihood of a text, i.e. the sum of the log-probabilities of all its n-grams.
+
+        Args:
+            codes (np.array): The codes of the text (see HMM_utils.string_to_codes).
+
+        Returns:
+            float: The log-likelihood of the text.
+        """
+        if self.log_probabilities is None:
+            self.compute_log_probabilities()
+        return float(np.sum(self.log_probabilities[self.ngram_indices(codes, self.n)]))
+
+    def model_arrays(self):
+        """
+        Returns the arrays of the model (counts, log-probabilities, n and smoothing), as stored by save and save_shared.
+        """
+        if self.log_probabilities is None:
+            self.compute_log_probabilities()
+        return {
+            "counts": self.counts,
+            "log_probabilities": self.log_probabilities,
+            "n": np.array(self.n),
+            "smoothing": np.array(self.smoothing),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Builds the model from the arrays returned by model_arrays. The text is not stored, so the model has an empty text.
+        """
+        model = cls("", n=int(arrays["n"]), smoothing=float(arrays["smoothing"]))
+        model.counts = arrays["counts"]
+        model.log_probabilities = arrays["log_probabilities"]
+        return model
+
+    def save(self, path):
+        """
+        Saves the counts and the log-probabilities to a binary .npz file, which can be loaded back with NgramModel.load.
+
+        Args:
+            path (str): The path of the file.
+        """
+        with open(path, "wb") as file:
+            np.savez(file, **self.model_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a model saved with save. The text is not stored, so the loaded object has an empty text.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            NgramModel: The loaded model.
+        """
+        with np.load(path) as data:
+            return cls.from_arrays(dict(data))
+
+    def save_shared(self, directory):
+        """
+        Saves the model in the flat format of SharedModel (one .npy file per array),
+        which worker processes open with open_shared.
+
+        Args:
+            directory (str): The directory of the model.
+        """
+        save_arrays(directory, self.model_arrays())
+
+    @classmethod
+    def open_shared(cls, directory):
+        """
+        Opens a model saved with save_shared: the log-probabilities are a read-only memory map of the file,
+        so any number of processes share the same memory and nothing is deserialized.
+
+        Args:
+            directory (str): The directory of the model.
+
+        Returns:
+            NgramModel: The model.
+        """
+        return cls.from_arrays(open_arrays(directory))
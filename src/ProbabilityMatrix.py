@@ -1,7 +1,16 @@
-from collections import Counter
-from src.HMM_utils import string_to_numbers, map_alphabet_to_numbers
+import hashlib
+import os
+
+from src.CipherUtils import TextPreProcessor
+from src.CorpusCounts import count_files
+from src.HMM_utils import string_to_codes
+from src.SharedModel import save_arrays, open_arrays
 import numpy as np
 
+# version of the models built by from_files, part of the corpus fingerprint: increase it whenever the way
+# the model is computed or stored changes, so that the models cached by the previous code are not reused
+MODEL_VERSION = 2
+
 
 class ProbabilityMatrix:
     def __init__(self, text):
@@ -16,11 +25,17 @@ class ProbabilityMatrix:
         """
         self.text = text
         self.all_2_chars = []
+        self.counts = None  # store the 27 x 27 matrix of the bigram counts
         self.probability_table = {}  # store the dictionary
         self.probability_matrix = None  # store the matrix
         self.normalized_matrix = (
             None  # store the normalized version of the matric, to be used in HMM
         )
+        self.trigram_tensor = (
+            None  # store the trigram probabilities, to be used in the second-order HMM
+        )
+        self.log_matrix = None  # store the log of the probability matrix
+        self.fingerprint = None  # store the hash of the corpus files, see from_files
 
         if self.has_uppercase():
             raise ImportWarning(
@@ -70,29 +85,38 @@ class ProbabilityMatrix:
                 elif y + x not in self.probability_table:
                     self.probability_table[x + y] = minimum"""
 
+    def compute_counts(self):
+        """
+        Computes the 27 x 27 matrix of the bigram counts: the text is encoded once into an array of codes
+        and every bigram (i, j) is counted with a single bincount on 27 * i + j.
+        The probability table, the probability matrix and the trigram tensor are all computed from the codes.
+        """
+        codes = string_to_codes(self.text).astype(np.intp)
+        self.counts = np.bincount(codes[:-1] * 27 + codes[1:], minlength=27**2)
+        self.counts = self.counts.reshape(27, 27)
+
     def compute_probability_table(self):
         """
         Computes the probability table for all two-character sequences in the text.
         The probability is calculated as the count of each sequence divided by the total count of all sequences.
         """
-        # to not recompute all_2_chars, if there is (i.e. if it has been called already by compute_probability_matrix)
-        if not self.all_2_chars:
-            self.all_2_chars = self.break_into_two_chars(self.text)
+        if self.counts is None:
+            self.compute_counts()
 
+        alphabet = "abcdefghijklmnopqrstuvwxyz "
+        n_bigrams = int(self.counts.sum())
         self.probability_table = {
-            two_char: count / len(self.all_2_chars)
-            for two_char, count in Counter(self.all_2_chars).items()
+            alphabet[i] + alphabet[j]: int(self.counts[i, j]) / n_bigrams
+            for i, j in zip(*np.nonzero(self.counts))
         }
 
         # check for missing bigrams in the corpus, add them to the dictionary
         minimum = min(self.probability_table.values())
         # print(minimum)
-        for x in "abcdefghijklmnopqrstuvwxyz ":
-            for y in "abcdefghijklmnopqrstuvwxyz ":
+        for x in alphabet:
+            for y in alphabet:
                 if x + y not in self.probability_table:
                     self.probability_table[x + y] = minimum
-                elif y + x not in self.probability_table:
-                    self.probability_table[y + x] = minimum
 
         self.probability_table["  "] = 0
 
@@ -109,26 +133,10 @@ class ProbabilityMatrix:
         return self.probability_table[two_char]
 
     def compute_probability_matrix(self):
-        # to not recompute all_2_chars, if there is (i.e. if it has been called already by compute_probability_table)
-        if not self.all_2_chars:
-            self.all_2_chars = self.break_into_two_chars(self.text)
-
-        dict = Counter(self.all_2_chars).copy()
-        for key in Counter(self.all_2_chars).keys():
-            new_key = str(string_to_numbers(key, map_alphabet_to_numbers()))
-            dict[new_key] = dict.pop(key)
-        table = {
-            two_char: count / len(self.all_2_chars) for two_char, count in dict.items()
-        }
+        if self.counts is None:
+            self.compute_counts()
 
-        probability_matrix = np.zeros((27, 27))
-
-        for key in table.keys():
-            i = eval(key)[0]
-            j = eval(key)[1]
-            probability_matrix[i, j] = table[key]
-
-        self.probability_matrix = np.array(probability_matrix)
+        self.probability_matrix = self.counts / self.counts.sum()
 
         minimum = np.min(self.probability_matrix[self.probability_matrix > 0])
         # print(minimum)
@@ -147,6 +155,250 @@ class ProbabilityMatrix:
         # Normalize each row
         self.normalized_matrix = self.probability_matrix / row_sums[:, np.newaxis]
 
+    def compute_log_matrix(self):
+        """
+        Computes the log of the probability matrix (the space-space entry is -inf).
+        """
+        if self.probability_matrix is None:
+            self.compute_probability_matrix()
+        with np.errstate(divide="ignore"):
+            self.log_matrix = np.log(self.probability_matrix)
+
+    def model_arrays(self):
+        """
+        Returns the arrays of the model (counts, probability matrix, normalized matrix, log matrix, alphabet,
+        corpus fingerprint and, if computed, trigram tensor), as stored by save and save_shared.
+        """
+        if self.log_matrix is None:
+            self.compute_log_matrix()
+        if self.normalized_matrix is None:
+            self.compute_normalized_matrix()
+
+        arrays = {
+            "counts": self.counts,
+            "probability_matrix": self.probability_matrix,
+            "normalized_matrix": self.normalized_matrix,
+            "log_matrix": self.log_matrix,
+            "alphabet": np.array(list("abcdefghijklmnopqrstuvwxyz ")),
+            "fingerprint": np.array(self.fingerprint or ""),
+        }
+        if self.trigram_tensor is not None:
+            arrays["trigram_tensor"] = self.trigram_tensor
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Builds the model from the arrays returned by model_arrays. The text is not stored,
+        so the model has an empty text and an empty probability table.
+        """
+        model = cls("")
+        model.counts = arrays["counts"]
+        model.probability_matrix = arrays["probability_matrix"]
+        model.normalized_matrix = arrays["normalized_matrix"]
+        model.log_matrix = arrays["log_matrix"]
+        model.fingerprint = str(arrays["fingerprint"]) or None
+        if "trigram_tensor" in arrays:
+            model.trigram_tensor = arrays["trigram_tensor"]
+        return model
+
+    def save(self, path):
+        """
+        Saves the model (counts, probability matrix, normalized matrix, log matrix, alphabet and
+        corpus fingerprint) to a binary .npz file, which can be loaded back with ProbabilityMatrix.load.
+
+        Args:
+            path (str): The path of the file.
+        """
+        with open(path, "wb") as file:
+            np.savez(file, **self.model_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a model saved with save. The text is not stored, so the loaded object has an empty text,
+        and the probability table is rebuilt from the counts.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            ProbabilityMatrix: The loaded model.
+        """
+        with np.load(path) as data:
+            model = cls.from_arrays(dict(data))
+        model.compute_probability_table()
+        return model
+
+    def save_shared(self, directory):
+        """
+        Saves the model in the flat format of SharedModel (one .npy file per array),
+        which worker processes open with open_shared.
+
+        Args:
+            directory (str): The directory of the model.
+        """
+        save_arrays(directory, self.model_arrays())
+
+    @classmethod
+    def open_shared(cls, directory):
+        """
+        Opens a model saved with save_shared: all its arrays are read-only memory maps of the files,
+        so any number of processes share the same memory and nothing is deserialized.
+        The probability table (a dict of Python floats) is not built: use probability_matrix or log_matrix,
+        or call compute_probability_table if the dict is really needed.
+
+        Args:
+            directory (str): The directory of the model.
+
+        Returns:
+            ProbabilityMatrix: The model.
+        """
+        return cls.from_arrays(open_arrays(directory))
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        Builds the model from the 27 x 27 matrix of the bigram counts, e.g. the output of CorpusCounts.count_files,
+        without the text.
+
+        Args:
+            counts (np.array): The bigram counts.
+
+        Returns:
+            ProbabilityMatrix: The model, with probability table, matrix, normalized matrix and log matrix computed.
+        """
+        model = cls("")
+        model.counts = counts
+        model.compute_probability_table()
+        model.compute_normalized_matrix()
+        model.compute_log_matrix()
+        return model
+
+    @staticmethod
+    def corpus_fingerprint(file_paths, preprocessor, streaming=False):
+        """
+        Computes a hash of the content of the corpus files, of the preprocessing settings and of MODEL_VERSION.
+
+        Args:
+            file_paths (list): The paths of the corpus files, in order.
+            preprocessor (TextPreProcessor): The preprocessor applied to the corpus.
+            streaming (bool, optional): Whether the files are counted one by one, see from_files. Defaults to False.
+
+        Returns:
+            str: The hexadecimal sha256 digest.
+        """
+        fingerprint = hashlib.sha256()
+        # the version of the model and the preprocessing steps of from_files:
+        # lower, remove_unknown_chars, remove_additional_spaces
+        fingerprint.update(
+            repr(
+                (
+                    MODEL_VERSION,
+                    "lower",
+                    "unknown",
+                    "spaces",
+                    list(preprocessor.alphabet),
+                    streaming,
+                )
+            ).encode()
+        )
+        for file_path in file_paths:
+            with open(file_path, "rb") as file:
+                fingerprint.update(hashlib.sha256(file.read()).digest())
+        return fingerprint.hexdigest()
+
+    @classmethod
+    def from_files(
+        cls,
+        file_paths,
+        cache_dir="outputs/models",
+        preprocessor=None,
+        streaming=False,
+        processes=None,
+    ):
+        """
+        Builds the model of the corpus made by the given files, as done in the notebooks, i.e. joining the files,
+        preprocessing them and computing the probability table, matrix, normalized matrix, log matrix and trigram tensor.
+        The model is saved in cache_dir under the fingerprint of the corpus, and loaded from there
+        (without reading and preprocessing the text again) as long as the files and the preprocessing are unchanged.
+
+        Args:
+            file_paths (list): The paths of the corpus files.
+            cache_dir (str, optional): The directory of the cached models. Set to None to disable the cache.
+            preprocessor (TextPreProcessor, optional): The preprocessor of the corpus. Defaults to TextPreProcessor().
+            streaming (bool, optional): If True the files are read in chunks and counted in parallel by
+                CorpusCounts.count_files (the default preprocessing is used, every file on its own so that there are
+                no bigrams across two files, and the text is not kept, so there is no trigram tensor). Defaults to False.
+            processes (int, optional): The number of processes used when streaming. Defaults to os.cpu_count().
+
+        Returns:
+            ProbabilityMatrix: The model of the corpus.
+        """
+        if preprocessor is None:
+            preprocessor = TextPreProcessor()
+
+        fingerprint = cls.corpus_fingerprint(file_paths, preprocessor, streaming)
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, f"{fingerprint}.npz")
+            if os.path.exists(cache_path):
+                return cls.load(cache_path)
+
+        if streaming:
+            model = cls.from_counts(count_files(file_paths, processes=processes))
+        else:
+            texts = []
+            for file_path in file_paths:
+                with open(file_path, "r") as file:
+                    texts.append(file.read())
+
+            corpus = preprocessor.lower("".join(texts))
+            corpus = preprocessor.remove_unknown_chars(
+                corpus, unknown_chars=preprocessor.unknown_chars(corpus)
+            )
+            corpus = preprocessor.remove_additional_spaces(corpus)
+
+            model = cls(corpus)
+            model.compute_probability_table()
+            model.compute_normalized_matrix()
+            model.compute_log_matrix()
+            model.compute_trigram_tensor()
+        model.fingerprint = fingerprint
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            model.save(cache_path)
+        return model
+
+    def compute_trigram_tensor(self):
+        """
+        Computes the trigram tensor, i.e. the probability of the third character given the previous two,
+        used by the second-order HMM (see HMM_second_order.py).
+        As for the probability matrix, missing trigrams get the minimum probability of the observed ones,
+        a space can not follow a space and every row is normalized.
+
+        Raises:
+            ValueError: If the model has no text (e.g. it was loaded or built from the counts)
+                and no trigram tensor was stored with it.
+        """
+        if not self.text:
+            if self.trigram_tensor is not None:
+                return  # loaded with the model, see from_files
+            raise ValueError(
+                "The trigram tensor needs the text of the corpus: this model has no text "
+                "(loaded, opened or built from the counts) and was saved without a trigram tensor."
+            )
+        codes = string_to_codes(self.text).astype(np.intp)
+        trigrams = (codes[:-2] * 27 + codes[1:-1]) * 27 + codes[2:]
+        counts = np.bincount(trigrams, minlength=27**3).reshape(27, 27, 27)
+
+        trigram_tensor = counts / len(trigrams)
+        minimum = np.min(trigram_tensor[trigram_tensor > 0])
+        trigram_tensor = np.where(trigram_tensor == 0, minimum, trigram_tensor)
+        trigram_tensor[:, -1, -1] = 0
+
+        self.trigram_tensor = trigram_tensor / trigram_tensor.sum(axis=2, keepdims=True)
+
     def get_probability_mat(self, char_1, char_2):
         """
         Returns the probability of char_2 given char_1. (using probability_matrix, the matrix)
@@ -181,5 +433,7 @@ class ProbabilityMatrix:
         """
         Saves the list of all two-character sequences to a file named 'all_2_chars.txt'.
         """
+        if not self.all_2_chars:
+            self.all_2_chars = self.break_into_two_chars(self.text)
         with open("outputs/all_2_chars.txt", "w") as file:
             print(self.all_2_chars, file=file)
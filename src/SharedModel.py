@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+# Flat on-disk format for the models shared by many worker processes: a directory with one .npy file per array.
+# Unlike the .npz files of ProbabilityMatrix.save / NgramModel.save, the .npy files can be opened with np.memmap,
+# so every worker maps the same pages of the page cache read-only, with no copy and no deserialization.
+
+
+def save_arrays(directory, arrays):
+    """
+    Saves every array in its own .npy file of the directory.
+
+    Args:
+        directory (str): The directory, created if missing.
+        arrays (dict): A dictionary name -> array.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.asarray(array))
+
+
+def open_arrays(directory):
+    """
+    Opens all the arrays saved with save_arrays as read-only memory maps.
+
+    Args:
+        directory (str): The directory.
+
+    Returns:
+        dict: A dictionary name -> np.memmap.
+    """
+    arrays = {}
+    for file_name in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file_name)
+        if extension == ".npy":
+            arrays[name] = np.load(os.path.join(directory, file_name), mmap_mode="r")
+    return arrays
@@ -0,0 +1,129 @@
+import time
+
+
+class StoppingCriteria:
+    def __init__(
+        self,
+        patience=None,
+        min_acceptance_rate=None,
+        window=1000,
+        agreement=None,
+        max_time=None,
+        max_evaluations=None,
+        target=None,
+    ):
+        """
+        Initializes the StoppingCriteria object, the early stopping rules of the MCMC runs of CipherBreaker.
+        Every rule is disabled when its argument is None; the run stops at the first rule that is met
+        and its name is stored in reason.
+
+        Args:
+            patience (int, optional): Stop ("patience") when the best log-likelihood has not improved for patience iterations.
+            min_acceptance_rate (float, optional): Stop ("acceptance") when the fraction of accepted proposals
+                over the last window iterations falls below min_acceptance_rate.
+            window (int, optional): The number of iterations over which the acceptance rate is measured. Defaults to 1000.
+            agreement (float, optional): Stop ("agreement") when at least this fraction of the chains has reached
+                the best log-likelihood (only for the runs with many chains).
+            max_time (float, optional): Stop ("time") after max_time seconds.
+            max_evaluations (int, optional): Stop ("evaluations") after max_evaluations evaluations of the log-likelihood.
+            target (float, optional): Stop ("target") as soon as the best log-likelihood reaches target,
+                e.g. the log-likelihood of the true key in a benchmark.
+        """
+        self.patience = patience
+        self.min_acceptance_rate = min_acceptance_rate
+        self.window = window
+        self.agreement = agreement
+        self.max_time = max_time
+        self.max_evaluations = max_evaluations
+        self.target = target
+
+        self.reason = None
+        self.start()
+
+    def start(self):
+        """
+        Starts a new run: the clock, the evaluation budget and the chain statistics are reset.
+        """
+        self.start_time = time.perf_counter()
+        self.n_evaluations = 0
+        self.restart_chain()
+
+    def restart_chain(self):
+        """
+        Resets the statistics of the chain (best log-likelihood and acceptance rate) but not the budgets,
+        e.g. at every new starting point of break_cipher_nstart.
+        """
+        self.reason = None
+        self.best_log_likelihood = -float("inf")
+        self.last_improvement = 0
+        self.last_iteration = -1
+        # iterations performed and proposals accepted in the current window of the acceptance rate
+        self.window_iterations = 0
+        self.window_accepted = 0
+
+    def update(
+        self,
+        iteration,
+        best_log_likelihood,
+        n_accepted,
+        n_evaluations=1,
+        n_chains=1,
+        agreement=None,
+    ):
+        """
+        Updates the statistics after one iteration and checks all the rules.
+
+        Args:
+            iteration (int): The iteration just performed.
+            best_log_likelihood (float): The best log-likelihood found so far.
+            n_accepted (int): The number of proposals accepted so far (by all the chains).
+            n_evaluations (int, optional): The number of log-likelihood evaluations of the iteration. Defaults to 1.
+            n_chains (int, optional): The number of chains, the acceptance rate is per chain. Defaults to 1.
+            agreement (float, optional): The fraction of the chains which have reached the best log-likelihood.
+
+        Returns:
+            str: The reason to stop, or None to go on.
+        """
+        self.n_evaluations += n_evaluations
+        # the samplers which check the rules every few iterations (e.g. break_cipher_tempering) skip some of them
+        self.window_iterations += iteration - self.last_iteration
+        self.last_iteration = iteration
+        if best_log_likelihood > self.best_log_likelihood:
+            self.best_log_likelihood = best_log_likelihood
+            self.last_improvement = iteration
+
+        if (
+            self.patience is not None
+            and iteration - self.last_improvement >= self.patience
+        ):
+            self.reason = "patience"
+        elif (
+            self.min_acceptance_rate is not None
+            and self.window_iterations >= self.window
+        ):
+            rate = (n_accepted - self.window_accepted) / (
+                self.window_iterations * n_chains
+            )
+            self.window_iterations, self.window_accepted = 0, n_accepted
+            if rate < self.min_acceptance_rate:
+                self.reason = "acceptance"
+        if self.reason is None:
+            if self.target is not None and self.best_log_likelihood >= self.target:
+                self.reason = "target"
+            elif (
+                self.agreement is not None
+                and agreement is not None
+                and agreement >= self.agreement
+            ):
+                self.reason = "agreement"
+            elif (
+                self.max_evaluations is not None
+                and self.n_evaluations >= self.max_evaluations
+            ):
+                self.reason = "evaluations"
+            elif (
+                self.max_time is not None
+                and time.perf_counter() - self.start_time >= self.max_time
+            ):
+                self.reason = "time"
+        return self.reason
@@ -0,0 +1,248 @@
+import contextlib
+import io
+import random
+import time
+
+import numpy as np
+
+from src.HMM_functions import forward_HMM, backward_HMM
+from src.HMM_functions import Baum_Welch, Baum_Welch_batch, log_likelihood
+from src.CipherBreaker import CipherBreaker
+from src.CipherScorer import cipher_to_decoding
+from src.CipherUtils import CipherGenerator, TextEncoder
+from src.StoppingCriteria import StoppingCriteria
+
+
+def forward_HMM_loop(A, B, pi, observed):
+    """
+    Reference implementation of forward_HMM with the explicit loop over nodes, states and states.
+    It is kept only as a baseline for the benchmarks below.
+    """
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+    alpha = np.zeros((n_nodes, n_states))
+    c = np.zeros(n_nodes)
+    alpha_hat = np.zeros((n_nodes, n_states))
+
+    for j in range(n_states):
+        alpha[0, j] = pi[j] * B[j, observed[0]]
+
+    c[0] = np.sum(alpha[0])
+    alpha_hat[0] = alpha[0] / np.sum(alpha[0])
+
+    for i in range(1, n_nodes):
+        for j in range(n_states):
+            for k in range(n_states):
+                alpha[i, j] += A[k, j] * B[j, observed[i]] * alpha_hat[i - 1, k]
+        c[i] = np.sum(alpha[i])
+        alpha_hat[i] = alpha[i] / c[i]
+    return alpha_hat, c
+
+
+def backward_HMM_loop(A, B, observed, c):
+    """
+    Reference implementation of backward_HMM with the explicit loop over nodes, states and states.
+    It is kept only as a baseline for the benchmarks below.
+    """
+    n_nodes = len(observed)
+    n_states = A.shape[0]
+    beta = np.zeros((n_nodes - 1, n_states))
+    beta_hat = np.zeros((n_nodes - 1, n_states))
+
+    for j in range(n_states):
+        for k in range(n_states):
+            beta[-1, j] += A[j, k] * B[k, observed[n_nodes - 1]]
+
+    beta_hat[-1] = beta[-1] / c[-1]
+
+    for i in range(n_nodes - 3, -1, -1):
+        for j in range(n_states):
+            for k in range(n_states):
+                beta[i, j] += A[j, k] * B[k, observed[i + 1]] * beta_hat[i + 1, k]
+        beta_hat[i] = beta[i] / c[i + 1]
+
+    return beta_hat
+
+
+def time_function(function, *args, n_repeats=3, **kwargs):
+    """
+    Returns the best wall-clock time (in seconds) over n_repeats calls of function(*args, **kwargs).
+    """
+    best = np.inf
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_forward_backward(A, B, pi, observed, lengths, n_repeats=3):
+    """
+    Compares the loop and the vectorized forward/backward passes for growing text lengths.
+    Input:
+        - A, B, pi: the parameters of the HMM
+        - observed: a list containing the observed sequence (at least max(lengths) long)
+        - lengths (list of int): the prefixes of observed to time
+        - n_repeats (int): number of timings per length, the best one is kept
+    Output:
+        - a list of dictionaries with keys length, loop, vectorized and speedup (times in seconds)
+    """
+
+    def run(forward, backward, obs):
+        alpha_hat, c = forward(A, B, pi, obs)
+        backward(A, B, obs, c)
+
+    results = []
+    for length in lengths:
+        obs = observed[:length]
+        loop = time_function(
+            run, forward_HMM_loop, backward_HMM_loop, obs, n_repeats=n_repeats
+        )
+        vectorized = time_function(
+            run, forward_HMM, backward_HMM, obs, n_repeats=n_repeats
+        )
+        results.append(
+            {
+                "length": length,
+                "loop": loop,
+                "vectorized": vectorized,
+                "speedup": loop / vectorized,
+            }
+        )
+    return results
+
+
+def benchmark_batch_throughput(
+    A, B_start, pi, observed_list, batch_sizes, maxIter=10, shared_key=False
+):
+    """
+    Compares the throughput (messages per second) of Baum_Welch called once per message
+    and of Baum_Welch_batch on batches of growing size.
+    Input:
+        - A, B_start, pi: the parameters of the HMM
+        - observed_list: a list of observed sequences (at least max(batch_sizes) of them)
+        - batch_sizes (list of int): the batch sizes to time
+        - maxIter (int): number of EM iterations of every run (tol is set to 0 so all of them are run)
+        - shared_key (bool): passed to Baum_Welch_batch
+    Output:
+        - a list of dictionaries with keys batch_size, sequential and batched (messages per second)
+    """
+
+    def run_sequential(batch):
+        for observed in batch:
+            Baum_Welch(A, B_start, pi, observed, maxIter=maxIter, tol=0)
+
+    def run_batched(batch):
+        Baum_Welch_batch(
+            A, B_start, pi, batch, maxIter=maxIter, tol=0, shared_key=shared_key
+        )
+
+    results = []
+    for batch_size in batch_sizes:
+        batch = observed_list[:batch_size]
+        with contextlib.redirect_stdout(io.StringIO()):
+            sequential = time_function(run_sequential, batch, n_repeats=1)
+            batched = time_function(run_batched, batch, n_repeats=1)
+        results.append(
+            {
+                "batch_size": batch_size,
+                "sequential": batch_size / sequential,
+                "batched": batch_size / batched,
+            }
+        )
+    return results
+
+
+def benchmark_accelerated_EM(A, B_start, pi, observed_dict, maxIter=300, tol=1e-4):
+    """
+    Compares plain Baum_Welch with the SQUAREM accelerated one (accelerate=True).
+    Input:
+        - A, B_start, pi: the parameters of the HMM
+        - observed_dict: a dictionary name -> observed sequence (e.g. one encrypted extract per text in texts/)
+        - maxIter, tol: passed to Baum_Welch
+    Output:
+        - a list of dictionaries, one per (name, method), with keys name, method, iterations, time and log_likelihood
+    """
+    results = []
+    for name, observed in observed_dict.items():
+        for method, accelerate in (("EM", False), ("SQUAREM", True)):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                B, n_iter = Baum_Welch(
+                    A,
+                    B_start,
+                    pi,
+                    observed,
+                    maxIter=maxIter,
+                    tol=tol,
+                    accelerate=accelerate,
+                    return_n_iter=True,
+                )
+                elapsed = time.perf_counter() - start
+            results.append(
+                {
+                    "name": name,
+                    "method": method,
+                    "iterations": n_iter,
+                    "time": elapsed,
+                    "log_likelihood": log_likelihood(A, B, pi, observed),
+                }
+            )
+    return results
+
+
+def benchmark_annealing(
+    probability_table, texts, schedules, max_iterations=100000, n_runs=3, seed=None
+):
+    """
+    Compares plain Metropolis with simulated annealing (CipherBreaker.break_cipher_counts with a schedule)
+    by the number of iterations needed to find the true key, i.e. to reach a log-likelihood at least
+    as high as the one of the true key.
+    Input:
+        - probability_table: the probability table of ProbabilityMatrix
+        - texts: a list of plain texts (preprocessed), e.g. extracts of 50 to 2000 characters
+        - schedules: a dictionary name -> schedule (see AnnealingSchedules), None for plain Metropolis
+        - max_iterations (int): the iterations of every run
+        - n_runs (int): number of runs (random key and random start) per text and schedule
+        - seed (int): seed of the random module
+    Output:
+        - a list of dictionaries, one per (text, schedule, run), with keys length, schedule, run and
+          iterations (None if the true key was not found)
+    """
+    random.seed(seed)
+    results = []
+    for text in texts:
+        for run in range(n_runs):
+            cipher = CipherGenerator().generate_cipher()
+            ciphered_text = TextEncoder().encode_text(text, cipher)
+            starting_cipher = CipherGenerator().generate_cipher()
+            run_seed = random.random()
+
+            for name, schedule in schedules.items():
+                cipher_breaker = CipherBreaker(
+                    CipherGenerator(), ciphered_text, probability_table
+                )
+                cipher_breaker.current_cipher = list(starting_cipher)
+                target = cipher_breaker.get_scorer().score(cipher_to_decoding(cipher))
+                stopping = StoppingCriteria(target=target)
+
+                state = random.getstate()
+                random.seed(run_seed)
+                cipher_breaker.break_cipher_counts(
+                    max_iterations, stopping=stopping, schedule=schedule
+                )
+                random.setstate(state)
+
+                results.append(
+                    {
+                        "length": len(text),
+                        "schedule": name,
+                        "run": run,
+                        "iterations": (
+                            stopping.last_improvement
+                            if cipher_breaker.stop_reason == "target"
+                            else None
+                        ),
+                    }
+                )
+    return results